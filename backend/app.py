@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import requests
 import os
@@ -6,21 +6,39 @@ import random
 import logging
 import re
 import json
+import time
+import contextvars
 import openai
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import transcript_log
+import upstream
+from session_store import create_session_store, new_session_id
+from price_extractor import extract_price_locally, prices_in_message, LOCAL_PRICE_CONFIDENCE
+from message_analysis import ANALYSIS_SCHEMA, analysis_system_prompt, map_intent, parse_analysis
+from phrasing import PhrasingPool, TERMINAL_TEMPLATES
+from history import window_history
+from intent_cache import IntentCache
+from policy import ConcessionPolicy, decision_prompt, format_price
 
 app = Flask(__name__)
 CORS(app)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Store conversation history and attempts
-conversation_history = [] 
-negotiation_attempts = 0  
-negotiation_closed = False  # Track if the negotiation has ended
-LAST_NEGOTIATED_PRICE = 1500  
+# Negotiation state is kept per session so concurrent users don't share a negotiation
+session_store = create_session_store()
+
+# Every turn is recorded as a structured event, written to disk in the background
+transcripts = transcript_log.create_transcript_log()
 
 # Set your OpenAI API key
 openai.api_key = os.getenv("OPENAI_API_KEY")  # Ensure your API key is set in the environment variable
+openai.max_retries = 0  # Retries are made by upstream_caller, within the turn's deadline
+
+# Every model call goes through this client. The async serving mode (asgi_app.py) swaps in
+# a bridge to its shared async client.
+client = openai
 
 MODEL = "ft:gpt-4o-2024-08-06:tekfrist::AQwRq6Hl"  # Use the OpenAI model you have access to (e.g., "gpt-4", "gpt-4-0613")
 
@@ -31,134 +49,365 @@ ACTUAL_PRICE = 1500
 CURRENCY = "£"
 COMPANY_NAME = "Elite Wheels"
 
-def get_openai_response(user_message):
-    global negotiation_attempts, LAST_NEGOTIATED_PRICE, negotiation_closed, conversation_history
+# "structured": one JSON call returns a message's intent and price, "legacy": separate price and intent calls
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "structured")
+ANALYSIS_MIN_CONFIDENCE = float(os.getenv("ANALYSIS_MIN_CONFIDENCE", 0.5))  # Less certain structured intents count as 'unknown'
+# "pool": terminal messages come from the pre-generated phrasing pool, "live": rephrase each one with the model
+PHRASING_MODE = os.getenv("PHRASING_MODE", "pool")
+TIMING_HEADERS = os.getenv("TIMING_HEADERS", "0") == "1"  # Add a Server-Timing breakdown to turn responses
+# "policy": counteroffers are decided by the concession policy and the model only words them,
+# "model": the model picks its own prices and each reply is analysed for its price and intent
+PRICING_MODE = os.getenv("PRICING_MODE", "policy")
+OFFER_ACCEPT_MARGIN = 0.02  # In model pricing, offers within 2% of our price are accepted
+
+pricing_policy = ConcessionPolicy(ACTUAL_PRICE, MIN_PRICE, MAX_ATTEMPTS)
+
+# Repeated and canonical short replies ("Deal!", "no thanks") are classified without a model call
+intent_cache = IntentCache()
+
+# Timeouts, retries, hedging and circuit breaking for every model call
+upstream_caller = upstream.UpstreamCaller()
+
+# Upstream calls within a turn that don't depend on each other run concurrently on this pool
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", 32))
+analysis_pool = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+
+def run_concurrently(*calls):
+    """
+    Runs independent (function, *args) calls on the analysis pool and returns their results in order.
+    """
+    # Each call runs in a copy of our context so its timing spans land in the current turn
+    futures = [analysis_pool.submit(contextvars.copy_context().run, function, *args) for function, *args in calls]
+    return [future.result() for future in futures]
+
+def chat_completion(purpose, **kwargs):
+    """
+    Calls the chat-completions API with MODEL through the current client and records a timing span
+    for the call under `purpose`. Streamed completions are recorded when the stream ends.
+    Raises upstream.CircuitOpenError or upstream.DeadlineExceeded when the call isn't made.
+    """
+    start = time.perf_counter()
+    try:
+        response = upstream_caller.call(purpose, client.chat.completions.create, model=MODEL, **kwargs)
+    except upstream.CircuitOpenError:
+        metrics.record_upstream(purpose, time.perf_counter() - start, 'circuit_open')
+        raise
+    except upstream.DeadlineExceeded:
+        metrics.record_upstream(purpose, time.perf_counter() - start, 'deadline')
+        raise
+    except Exception:
+        metrics.record_upstream(purpose, time.perf_counter() - start, 'error')
+        raise
+    if kwargs.get('stream'):
+        return metrics.timed_stream(purpose, response, start)
+    metrics.record_upstream(purpose, time.perf_counter() - start, 'ok', getattr(response, 'usage', None))
+    return response
+
+def new_negotiation_state():
+    """Returns the state of a fresh negotiation."""
+    return {
+        'conversation_history': [],
+        'negotiation_attempts': 0,
+        'negotiation_closed': False,  # Track if the negotiation has ended
+        'deal_price': None,  # Price the negotiation closed a deal at
+        'last_negotiated_price': ACTUAL_PRICE,
+        'user_offers': [],  # Prices offered so far, kept for the history summary
+        'bot_offers': []
+    }
+
+def get_openai_response(state, user_message):
+    response, turn = start_turn(state, user_message)
+    if response is not None:
+        return response
+
+    # Proceed to generate assistant's response
+    try:
+        response = chat_completion(
+            'negotiation',
+            messages=build_negotiation_prompt(state, turn['decision'])
+        )
+        bot_message = response.choices[0].message.content.strip()
+    except Exception as e:
+        logging.error(f"Error connecting to OpenAI API: {e}")
+        metrics.ERRORS.inc(kind='negotiation')
+        return fallback_response(state, turn)
+    try:
+        return finish_turn(state, turn, bot_message)
+    except Exception as e:
+        logging.error(f"Error finishing turn: {e}", exc_info=True)
+        metrics.ERRORS.inc(kind='turn')
+        return error_response(state)
+
+def stream_openai_response(state, user_message):
+    """
+    Same turn as get_openai_response, but yields ('token', text) pieces of the reply as the
+    model produces them, followed by ('done', response) once the reply has been analysed.
+    """
+    response, turn = start_turn(state, user_message)
+    if response is not None:
+        yield 'token', response['response']
+        yield 'done', response
+        return
+
+    pieces = []
+    try:
+        stream = chat_completion(
+            'negotiation',
+            messages=build_negotiation_prompt(state, turn['decision']),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                pieces.append(delta)
+                yield 'token', delta
+        bot_message = ''.join(pieces).strip()
+    except Exception as e:
+        logging.error(f"Error streaming from OpenAI API: {e}")
+        metrics.ERRORS.inc(kind='negotiation')
+        response = fallback_response(state, turn)
+        if not pieces:
+            yield 'token', response['response']
+        # Otherwise the 'done' event's reply replaces the partial one
+        yield 'done', response
+        return
+    try:
+        response = finish_turn(state, turn, bot_message)
+    except Exception as e:
+        logging.error(f"Error finishing turn: {e}", exc_info=True)
+        metrics.ERRORS.inc(kind='turn')
+        response = error_response(state)
+    yield 'done', response
 
-    if negotiation_closed:
+def build_negotiation_prompt(state, decision=None):
+    """
+    Returns the messages for the negotiation completion, with older turns compacted
+    into a summary once the history outgrows HISTORY_TOKEN_BUDGET.
+    With a policy decision the model is told exactly which price to offer.
+    """
+    price_state = (
+        f"Current negotiation state: your last offered price is {state['last_negotiated_price']} {CURRENCY}. "
+        f"This is attempt {state['negotiation_attempts'] + 1} of {MAX_ATTEMPTS}."
+    )
+    if decision is not None:
+        price_state += " " + decision_prompt(decision, CURRENCY)
+    messages, full_tokens, prompt_tokens = window_history(
+        state['conversation_history'], price_state, state['user_offers'], state['bot_offers'], CURRENCY
+    )
+    logging.info(f"Prompt tokens for negotiation completion: {full_tokens} before compaction, {prompt_tokens} after")
+    return messages
+
+def fallback_response(state, turn):
+    """
+    Answers a turn without the model when the negotiation completion fails: the pricing
+    policy decides the price (in either pricing mode) and a template words it.
+    """
+    decision = turn['decision'] or pricing_policy.decide(
+        turn['negotiator_price'], state['negotiation_attempts'], turn['user_offer'], turn['previous_offers']
+    )
+    logging.warning(f"Answering from the pricing policy and templates: {decision}")
+    metrics.FALLBACKS.inc(kind='negotiation_template')
+    transcript_log.note(fallback=True)
+    if decision.action == 'accept':
+        state['last_negotiated_price'] = decision.price
+        state['negotiation_closed'] = True
         return {
-            'response': generate_natural_response("The negotiation has ended. No more offers can be made."),
-            'last_negotiated_price': LAST_NEGOTIATED_PRICE,
+            'response': finalize_negotiation(state, decision.price, close_offer=True),
+            'last_negotiated_price': state['last_negotiated_price'],
             'show_buttons': False
         }
+    return finish_policy_turn(state, decision, terminal_message('counteroffer', price=decision.price))
+
+def error_response(state):
+    transcript_log.note(outcome='error')
+    return {
+        'response': "Sorry, something went wrong!",
+        'last_negotiated_price': state['last_negotiated_price'],
+        'show_buttons': False
+    }
+
+def start_turn(state, user_message):
+    """
+    Runs the part of a turn before the negotiation completion.
+    Returns (response, None) when the turn ends without the model, otherwise (None, turn) where
+    turn carries what finish_turn needs once the model has replied.
+    """
+    conversation_history = state['conversation_history']
+
+    transcript_log.note(user_message=user_message, attempt=state['negotiation_attempts'] + 1)
+    if state['negotiation_closed']:
+        transcript_log.note(outcome='ended')
+        return {
+            'response': terminal_message('ended'),
+            'last_negotiated_price': state['last_negotiated_price'],
+            'show_buttons': False
+        }, None
 
-    logging.info(f"last negotiated price: {LAST_NEGOTIATED_PRICE}")
+    logging.info(f"last negotiated price: {state['last_negotiated_price']}")
     conversation_history.append({"role": "user", "content": user_message})
-    user_offer = extract_price_from_message(user_message, 'user')
 
-    # Classify user's intent before generating assistant's response
-    user_intent = classify_user_intent(user_message)
+    # A turn runs as three stages, each waiting only on the one before it:
+    #   1. user message analysis     (price extraction || intent classification in legacy mode)
+    #   2. negotiation completion    (skipped when stage 1 closes the negotiation)
+    #   3. bot message analysis      (price extraction || intent classification in legacy mode)
+    # In policy pricing mode the bot's price is decided before stage 2, so stage 3 is skipped.
+    # Stage 1 runs before generating assistant's response
+    previous_offers = list(state['user_offers'])
+    user_offer, user_intent = analyze_message(user_message, 'user')
     logging.info(f"User intent: {user_intent}")
+    transcript_log.note(user_offer=user_offer, user_intent=user_intent, offered_price=state['last_negotiated_price'])
+    if user_offer is not None:
+        state['user_offers'].append(user_offer)
 
     # Handle user's acceptance or rejection before calling the assistant's response
     if user_intent == "acceptance":
-        negotiation_closed = True
-        bot_message = finalize_negotiation(LAST_NEGOTIATED_PRICE, close_offer=True)
-        logging.info(f"Finalized negotiation with price: {LAST_NEGOTIATED_PRICE}")
+        state['negotiation_closed'] = True
+        bot_message = finalize_negotiation(state, state['last_negotiated_price'], close_offer=True)
+        logging.info(f"Finalized negotiation with price: {state['last_negotiated_price']}")
         return {
-            'response': generate_natural_response(bot_message),
-            'last_negotiated_price': LAST_NEGOTIATED_PRICE,
+            'response': bot_message,
+            'last_negotiated_price': state['last_negotiated_price'],
             'show_buttons': False
-        }
+        }, None
     elif user_intent == "rejection":
-        negotiation_closed = True
-        bot_message = "Sorry that we couldn't reach an agreement. Better luck next time!"
+        state['negotiation_closed'] = True
+        transcript_log.note(outcome='rejected')
+        bot_message = terminal_message('rejection')
         return {
-            'response': generate_natural_response(bot_message),
-            'last_negotiated_price': LAST_NEGOTIATED_PRICE,
+            'response': bot_message,
+            'last_negotiated_price': state['last_negotiated_price'],
             'show_buttons': False
-        }
+        }, None
 
-    negotiator_price = LAST_NEGOTIATED_PRICE if LAST_NEGOTIATED_PRICE is not None else ACTUAL_PRICE
+    negotiator_price = state['last_negotiated_price'] if state['last_negotiated_price'] is not None else ACTUAL_PRICE
+
+    decision = None
+    if PRICING_MODE == "policy":
+        decision = pricing_policy.decide(negotiator_price, state['negotiation_attempts'], user_offer, previous_offers)
+        logging.info(f"Pricing policy decision: {decision}")
+        transcript_log.note(policy_action=decision.action, policy_price=decision.price)
 
     # Check if the user's offer is acceptable
-    if user_offer is not None and negotiator_price is not None:
-        if abs(user_offer - negotiator_price) <= (0.02 * negotiator_price):
-            LAST_NEGOTIATED_PRICE = user_offer
-            negotiation_closed = True
-            bot_message = finalize_negotiation(LAST_NEGOTIATED_PRICE, close_offer=True)
-            logging.info(f"User's offer accepted: {LAST_NEGOTIATED_PRICE}")
+    if decision is not None and decision.action == 'accept':
+        state['last_negotiated_price'] = decision.price
+        state['negotiation_closed'] = True
+        bot_message = finalize_negotiation(state, decision.price, close_offer=True)
+        logging.info(f"User's offer accepted by the pricing policy: {decision.price}")
+        return {
+            'response': bot_message,
+            'last_negotiated_price': state['last_negotiated_price'],
+            'show_buttons': False
+        }, None
+    if decision is None and user_offer is not None and negotiator_price is not None:
+        if abs(user_offer - negotiator_price) <= (OFFER_ACCEPT_MARGIN * negotiator_price):
+            state['last_negotiated_price'] = user_offer
+            state['negotiation_closed'] = True
+            bot_message = finalize_negotiation(state, state['last_negotiated_price'], close_offer=True)
+            logging.info(f"User's offer accepted: {state['last_negotiated_price']}")
             return {
-                'response': generate_natural_response(bot_message),
-                'last_negotiated_price': LAST_NEGOTIATED_PRICE,
+                'response': bot_message,
+                'last_negotiated_price': state['last_negotiated_price'],
                 'show_buttons': False
-            }
+            }, None
 
-    if negotiation_attempts >= MAX_ATTEMPTS:
-        negotiation_closed = True  # Close the negotiation
-        bot_message = generate_natural_response(
-            f"We've reached the maximum negotiation attempts. Our final price is {negotiator_price} {CURRENCY}."
-        )
+    if state['negotiation_attempts'] >= MAX_ATTEMPTS:
+        state['negotiation_closed'] = True  # Close the negotiation
+        transcript_log.note(outcome='max_attempts')
+        bot_message = terminal_message('max_attempts', price=negotiator_price)
         return {
             'response': bot_message,
             'last_negotiated_price': negotiator_price,
             'show_buttons': True
-        }
+        }, None
 
-    # Proceed to generate assistant's response
-    try:
-        response = openai.chat.completions.create(
-            model=MODEL,
-            messages=conversation_history
-        )
-        bot_message = response.choices[0].message.content.strip()
-        logging.info(f"Bot's message: {bot_message}")
-
-        bot_price = extract_price_from_message(bot_message, 'assistant')
-        logging.info(f"Price extracted from bot response: {bot_price}")
-
-        conversation_history.append({"role": "assistant", "content": bot_message})
-
-        # Classify assistant's intent
-        assistant_intent = classify_assistant_intent(bot_message)
-        logging.info(f"Assistant intent: {assistant_intent}")
-
-        # Update LAST_NEGOTIATED_PRICE if bot provided a new price
-        if bot_price is not None:
-            LAST_NEGOTIATED_PRICE = bot_price
-            logging.info(f"Updated LAST_NEGOTIATED_PRICE to {LAST_NEGOTIATED_PRICE}")
-            
-        if user_offer is not None:
-            if abs(user_offer - negotiator_price) <= (0.02 * negotiator_price):
-                LAST_NEGOTIATED_PRICE = user_offer
-                negotiation_closed = True
-                bot_message = finalize_negotiation(LAST_NEGOTIATED_PRICE, close_offer=True)
-                logging.info(f"User's offer accepted: {LAST_NEGOTIATED_PRICE}")
-                return {
-                    'response': generate_natural_response(bot_message),
-                    'last_negotiated_price': LAST_NEGOTIATED_PRICE,
-                    'show_buttons': False
-                }
-
-        # Handle assistant's acceptance
-        if assistant_intent == "acceptance":
-            negotiation_closed = True
-            bot_message = finalize_negotiation(LAST_NEGOTIATED_PRICE, close_offer=True)
-            logging.info(f"Finalized negotiation with price: {LAST_NEGOTIATED_PRICE}")
+    return None, {'user_offer': user_offer, 'negotiator_price': negotiator_price, 'decision': decision, 'previous_offers': previous_offers}
+
+def finish_turn(state, turn, bot_message):
+    """
+    Analyses the negotiator's finished reply and returns the turn's response.
+    """
+    user_offer = turn['user_offer']
+    negotiator_price = turn['negotiator_price']
+    logging.debug(f"Bot's message: {bot_message}")
+
+    if turn['decision'] is not None:
+        return finish_policy_turn(state, turn['decision'], bot_message)
+
+    state['conversation_history'].append({"role": "assistant", "content": bot_message})
+
+    # Extract the bot's price and classify its intent together
+    bot_price, assistant_intent = analyze_message(bot_message, 'assistant')
+    logging.info(f"Price extracted from bot response: {bot_price}")
+    logging.info(f"Assistant intent: {assistant_intent}")
+    transcript_log.note(bot_message=bot_message, bot_price=bot_price, assistant_intent=assistant_intent)
+
+    # Update the last negotiated price if bot provided a new price
+    if bot_price is not None:
+        state['bot_offers'].append(bot_price)
+        state['last_negotiated_price'] = bot_price
+        logging.info(f"Updated last negotiated price to {state['last_negotiated_price']}")
+
+    if user_offer is not None:
+        if abs(user_offer - negotiator_price) <= (OFFER_ACCEPT_MARGIN * negotiator_price):
+            state['last_negotiated_price'] = user_offer
+            state['negotiation_closed'] = True
+            bot_message = finalize_negotiation(state, state['last_negotiated_price'], close_offer=True)
+            logging.info(f"User's offer accepted: {state['last_negotiated_price']}")
             return {
-                'response': generate_natural_response(bot_message),
-                'last_negotiated_price': LAST_NEGOTIATED_PRICE,
+                'response': bot_message,
+                'last_negotiated_price': state['last_negotiated_price'],
                 'show_buttons': False
             }
 
-        negotiation_attempts += 1
+    # Handle assistant's acceptance
+    if assistant_intent == "acceptance":
+        state['negotiation_closed'] = True
+        bot_message = finalize_negotiation(state, state['last_negotiated_price'], close_offer=True)
+        logging.info(f"Finalized negotiation with price: {state['last_negotiated_price']}")
         return {
             'response': bot_message,
-            'last_negotiated_price': LAST_NEGOTIATED_PRICE,
-            'show_buttons': False
-        }
-    except Exception as e:
-        logging.error(f"Error connecting to OpenAI API: {e}")
-        return {
-            'response': "Sorry, something went wrong!",
-            'last_negotiated_price': LAST_NEGOTIATED_PRICE,
+            'last_negotiated_price': state['last_negotiated_price'],
             'show_buttons': False
         }
 
+    state['negotiation_attempts'] += 1
+    transcript_log.note(outcome='counter')
+    return {
+        'response': bot_message,
+        'last_negotiated_price': state['last_negotiated_price'],
+        'show_buttons': False
+    }
+
+def finish_policy_turn(state, decision, bot_message):
+    """
+    Records a counteroffer decided by the pricing policy. The reply is only checked for the
+    decided price, and replaced by a template if it names any other price.
+    """
+    other_prices = [price for price in prices_in_message(bot_message) if abs(price - decision.price) >= 0.01]
+    if other_prices:
+        logging.warning(f"Reply names {other_prices} besides the decided {decision.price}, using the template")
+        metrics.FALLBACKS.inc(kind='policy_reply_mismatch')
+        transcript_log.note(rejected_bot_message=bot_message)
+        bot_message = terminal_message('counteroffer', price=decision.price)
+    transcript_log.note(bot_message=bot_message, bot_price=decision.price)
+
+    state['conversation_history'].append({"role": "assistant", "content": bot_message})
+    state['bot_offers'].append(decision.price)
+    state['last_negotiated_price'] = decision.price
+    state['negotiation_attempts'] += 1
+    transcript_log.note(outcome='counter')
+    return {
+        'response': bot_message,
+        'last_negotiated_price': state['last_negotiated_price'],
+        'show_buttons': False
+    }
+
 def extract_price_from_message(message, speaker):
     """
-    Extract the most relevant price from the message using the OpenAI API.
+    Extract the most relevant price from the message, falling back to the OpenAI API when it is ambiguous.
     """
-    logging.info(f"Extracting price from message from {speaker}: {message}")
+    logging.debug(f"Extracting price from message from {speaker}: {message}")
 
     if speaker == 'user':
         system_prompt = (
@@ -178,14 +427,22 @@ def extract_price_from_message(message, speaker):
         logging.error("Invalid speaker specified.")
         return None
 
+    # Most messages carry an unambiguous price (or none), so only ask the model when the local extractor is unsure
+    local = extract_price_locally(message)
+    if local.confidence >= LOCAL_PRICE_CONFIDENCE:
+        logging.info(f"Extracted price locally: {local.price} ({local.reason}, confidence {local.confidence})")
+        return local.price
+    logging.info(f"Local price extraction is ambiguous ({local.reason}), asking the model")
+    metrics.FALLBACKS.inc(kind='price_model')
+
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": message}
     ]
 
     try:
-        response = openai.chat.completions.create(
-            model=MODEL,
+        response = chat_completion(
+            f'price_{speaker}',
             messages=messages
         )
         extracted_text = response.choices[0].message.content.strip()
@@ -218,20 +475,24 @@ def extract_price_from_message(message, speaker):
                 return None
 
     except Exception as e:
-        logging.error(f"Error extracting price using OpenAI API: {e}", exc_info=True)
-        return None
+        logging.error(f"Error extracting price using OpenAI API, using the local extraction: {e}")
+        return local.price
 
-def finalize_negotiation(last_price, close_offer=False):
+def finalize_negotiation(state, last_price, close_offer=False):
     """
     Finalizes the negotiation process.
     """
     if close_offer:
+        metrics.DEALS_CLOSED.inc()
+        state['deal_price'] = last_price
         discount_code = generate_random_code()
-        bot_message = f"Deal closed! We've accepted your offer of {last_price} {CURRENCY}. Here's your discount code: {discount_code}. Thank you for negotiating with us!"
+        transcript_log.note(outcome='deal', deal_price=last_price, discount_code=discount_code)
+        bot_message = terminal_message('deal_closed', price=last_price, code=discount_code)
     else:
-        bot_message = "No deal reached. Thank you for your time!"
+        transcript_log.note(outcome='no_deal')
+        bot_message = terminal_message('no_deal')
 
-    reset_conversation()
+    reset_conversation(state)
     return bot_message
 
 def classify_user_intent(user_message):
@@ -257,21 +518,14 @@ def classify_user_intent(user_message):
     ]
 
     try:
-        response = openai.chat.completions.create(
-            model=MODEL,
+        response = chat_completion(
+            'intent_user',
             messages=messages
         )
         intent = response.choices[0].message.content.strip().lower()
         logging.info(f'User intent is {intent}')
         # Map the response to predefined intents
-        if "acceptance" in intent:
-            return "acceptance"
-        elif "rejection" in intent:
-            return "rejection"
-        elif "negotiation" in intent:
-            return "negotiation"
-        else:
-            return "unknown"
+        return map_intent(intent)
     except Exception as e:
         logging.error(f"Error classifying user intent with OpenAI API: {e}")
         return "unknown"
@@ -299,33 +553,97 @@ def classify_assistant_intent(bot_message):
     ]
 
     try:
-        response = openai.chat.completions.create(
-            model=MODEL,
+        response = chat_completion(
+            'intent_assistant',
             messages=messages
         )
         intent = response.choices[0].message.content.strip().lower()
         logging.info(f'Assistant intent is {intent}')
         # Map the response to predefined intents
-        if "acceptance" in intent:
-            return "acceptance"
-        elif "rejection" in intent:
-            return "rejection"
-        elif "negotiation" in intent:
-            return "negotiation"
-        else:
-            return "unknown"
+        return map_intent(intent)
     except Exception as e:
         logging.error(f"Error classifying assistant intent with OpenAI API: {e}")
         return "unknown"
 
-def initialize_openai_response(user_message):
-    global negotiation_attempts, LAST_NEGOTIATED_PRICE, negotiation_closed
-    conversation_history.clear()
-    negotiation_attempts = 0
-    negotiation_closed = False  # Reset negotiation closed flag
+def analyze_message(message, speaker):
+    """
+    Returns the (price, intent) of a user or assistant message.
+    """
+    cached = intent_cache.get(message, speaker)
+    if cached is not None:
+        logging.info(f"Analysis of {speaker} message served from the intent cache: {cached}")
+        metrics.INTENT_CACHE.inc(result='hit')
+        return cached
+    metrics.INTENT_CACHE.inc(result='miss')
+
+    if ANALYSIS_MODE == "legacy":
+        classify = classify_user_intent if speaker == 'user' else classify_assistant_intent
+        price, intent = run_concurrently(
+            (extract_price_from_message, message, speaker),
+            (classify, message)
+        )
+        return price, intent
+    return analyze_message_structured(message, speaker)
+
+def analyze_message_structured(message, speaker):
+    """
+    Classifies the intent and extracts the price of a message with a single structured OpenAI API call.
+    """
+    logging.debug(f"Analysing message from {speaker}: {message}")
+    local = extract_price_locally(message)
+    local_price = local.price if local.confidence >= LOCAL_PRICE_CONFIDENCE else None
+
+    messages = [
+        {"role": "system", "content": analysis_system_prompt(speaker)},
+        {"role": "user", "content": message}
+    ]
+
+    try:
+        response = chat_completion(
+            f'analysis_{speaker}',
+            messages=messages,
+            response_format={"type": "json_schema", "json_schema": ANALYSIS_SCHEMA}
+        )
+        analysis = parse_analysis(response.choices[0].message.content)
+        logging.info(f"Analysis of {speaker} message: {analysis}")
+    except Exception as e:
+        logging.error(f"Error analysing {speaker} message with OpenAI API: {e}")
+        metrics.ERRORS.inc(kind='analysis')
+        return local_price, "unknown"
+
+    intent = analysis['intent'] if analysis['confidence'] >= ANALYSIS_MIN_CONFIDENCE else "unknown"
+    # The local extractor is exact when it is confident, so only use the model's price for ambiguous messages
+    price = local_price if local.confidence >= LOCAL_PRICE_CONFIDENCE else analysis['price']
+    if local.confidence >= LOCAL_PRICE_CONFIDENCE:
+        intent_cache.learn(message, speaker, price, intent, analysis['confidence'])
+    return price, intent
+
+def initialize_openai_response(state, user_message):
+    start_negotiation(state)
+    return get_openai_response(state, user_message)
+
+def start_negotiation(state):
+    """
+    Resets the state to a fresh negotiation and sets up the negotiator's system prompt.
+    """
+    state.update(new_negotiation_state())
     first_discounted_price = generate_random_discount(ACTUAL_PRICE)
-    LAST_NEGOTIATED_PRICE = first_discounted_price  # **Set LAST_NEGOTIATED_PRICE to assistant's first offer**
-    conversation_history.append({
+    state['last_negotiated_price'] = first_discounted_price  # **Set the last negotiated price to assistant's first offer**
+    if PRICING_MODE == "policy":
+        state['conversation_history'].append({
+            "role": "system",
+            "content": (
+                f"You are a friendly British price negotiator working for {COMPANY_NAME}. "
+                f"You are selling a set of 4 wheels for {ACTUAL_PRICE} {CURRENCY}. "
+                f"Always start by always offering a price of {first_discounted_price} {CURRENCY} first. "
+                "Each turn you will be told exactly which price to offer. Only ever offer that price, never accept an offer "
+                "yourself and never mention any other price, including the price that the user offered. "
+                "Always offer the price in the format '£<price>' or '<price> GBP' and don't mention the discount amount. "
+                "Keep your replies short, warm and natural."
+            )
+        })
+        return
+    state['conversation_history'].append({
         "role": "system",
         "content": (
             f"You are a friendly British price negotiator working for {COMPANY_NAME}. "
@@ -341,31 +659,139 @@ def initialize_openai_response(user_message):
             "If the user accepts your price, just accept it."
         )
     })
-    return get_openai_response(user_message)
  
 def generate_random_code():
     """Generates a random 6-digit discount code."""
     return ''.join(random.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=6))
 
-def reset_conversation():
+def reset_conversation(state):
     """Reset the conversation history and negotiation attempts after a conversation ends."""
-    global conversation_history, negotiation_attempts, LAST_NEGOTIATED_PRICE
-    conversation_history.clear()
-    negotiation_attempts = 0
-    LAST_NEGOTIATED_PRICE = None  # **Reset LAST_NEGOTIATED_PRICE to None**
+    state['conversation_history'].clear()
+    state['negotiation_attempts'] = 0
+    state['last_negotiated_price'] = None  # **Reset the last negotiated price to None**
+    state['user_offers'].clear()
+    state['bot_offers'].clear()
+
+TURN_ENDPOINTS = ('chatbot_response', 'chatbot_stream', 'chatbot_initialize')
+
+@app.before_request
+def start_turn_timing():
+    if request.endpoint in TURN_ENDPOINTS:
+        g.turn_timing = metrics.begin_turn(request.endpoint)
+        g.transcript_event = transcript_log.begin_turn(request.endpoint)
+        upstream.begin_turn()
+
+@app.after_request
+def finish_turn_timing(response):
+    timing = g.pop('turn_timing', None)
+    # Streamed turns finish their timing when the stream ends
+    if timing is None or response.is_streamed:
+        return response
+    timing.finish()
+    if TIMING_HEADERS:
+        response.headers['Server-Timing'] = timing.server_timing()
+    return response
+
+def record_turn(event, timing, session_id, bot_response):
+    """
+    Completes a turn's transcript event with its response and timing and queues it for writing.
+    """
+    if transcripts is None:
+        return
+    timing.finish()
+    event.update(
+        session_id=session_id,
+        response=bot_response['response'],
+        last_negotiated_price=bot_response['last_negotiated_price'],
+        show_buttons=bot_response['show_buttons'],
+        pricing_mode=PRICING_MODE,
+        duration_ms=round(1000 * timing.duration, 1),
+        upstream=timing.spans
+    )
+    transcripts.record(event)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def closing_fields(state):
+    """Tells clients whether the negotiation has ended and, if it closed a deal, at what price."""
+    return {'negotiation_closed': state['negotiation_closed'], 'deal_price': state.get('deal_price')}
+
+def load_session(data):
+    """
+    Returns (session_id, state) for the session named in a request body.
+    An unknown or expired session starts a new negotiation under a new id.
+    """
+    session_id = data.get('session_id')
+    state = session_store.get(session_id) if session_id else None
+    if state is None:
+        logging.info(f"No state for session {session_id}, starting a new negotiation")
+        session_id = new_session_id()
+        state = new_negotiation_state()
+        start_negotiation(state)
+    return session_id, state
 
 @app.route('/chatbot', methods=['POST'])
 def chatbot_response():
     data = request.get_json()
     user_message = data['message']
-    bot_response = get_openai_response(user_message)
+    session_id, state = load_session(data)
+    bot_response = get_openai_response(state, user_message)
+    session_store.save(session_id, state)
+    record_turn(g.transcript_event, g.turn_timing, session_id, bot_response)
+    bot_response.update(closing_fields(state))
+    bot_response['session_id'] = session_id
     return jsonify(bot_response)
 
+@app.route('/chatbot/stream', methods=['POST'])
+def chatbot_stream():
+    """
+    Streams the negotiator's reply as server-sent events: 'token' events carry pieces of the
+    reply text, then one 'done' event carries the full response like /chatbot returns.
+    Pass "initialize": true to start a new negotiation, as /initialize does.
+    """
+    data = request.get_json()
+    user_message = data['message']
+    if data.get('initialize'):
+        session_id, state = new_session_id(), new_negotiation_state()
+        start_negotiation(state)
+    else:
+        session_id, state = load_session(data)
+
+    timing = g.turn_timing
+    transcript_event = g.transcript_event
+
+    def events():
+        for event, payload in stream_openai_response(state, user_message):
+            if event == 'token':
+                payload = {'text': payload}
+            else:
+                session_store.save(session_id, state)
+                timing.finish()
+                record_turn(transcript_event, timing, session_id, payload)
+                payload = {**payload, **closing_fields(state), 'session_id': session_id}
+                if TIMING_HEADERS:
+                    payload['timing'] = timing.summary()  # Headers are already sent, so the breakdown rides on the event
+            yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/initialize', methods=['POST'])
 def chatbot_initialize():
     data = request.get_json()
     user_message = data['message']
-    bot_response = initialize_openai_response(user_message)  # Adjusted to initialize with OpenAI
+    session_id = new_session_id()
+    state = new_negotiation_state()
+    bot_response = initialize_openai_response(state, user_message)  # Adjusted to initialize with OpenAI
+    session_store.save(session_id, state)
+    record_turn(g.transcript_event, g.turn_timing, session_id, bot_response)
+    bot_response.update(closing_fields(state))
+    bot_response['session_id'] = session_id
     return jsonify(bot_response)
 
 def generate_random_discount(original_price):
@@ -386,8 +812,8 @@ def generate_natural_response(prompt):
     ]
     
     try:
-        response = openai.chat.completions.create(
-            model=MODEL,
+        response = chat_completion(
+            'rephrase',
             messages=messages
         )
         natural_response = response.choices[0].message.content.strip()
@@ -395,8 +821,43 @@ def generate_natural_response(prompt):
         return natural_response
 
     except Exception as e:
-        logging.error(f"Error connecting to OpenAI API: {e}")
-        return "Sorry, I couldn't process your request."
+        logging.error(f"Error connecting to OpenAI API, using the prompt as it is: {e}")
+        return prompt
+
+def rephrase_template(template):
+    """
+    Asks the OpenAI API for a natural-sounding rephrasing of a terminal template, keeping its slots intact.
+    Errors are left to the caller so a failed rephrasing never ends up in the phrasing pool.
+    """
+    messages = [
+        {
+            "role": "user",
+            "content": (
+                "Please rephrase the following to sound more natural and human-like without changing its meaning. "
+                "Keep every placeholder in curly braces, such as {price}, exactly as written and reply with the rephrased text only: "
+                f"'{template}'"
+            )
+        }
+    ]
+    response = chat_completion(
+        'rephrase_template',
+        messages=messages
+    )
+    return response.choices[0].message.content.strip().strip("'\"")
+
+def terminal_message(key, **slots):
+    """
+    Returns a natural-sounding terminal message, filling the template slots locally.
+    """
+    if slots.get('price') is not None:
+        slots['price'] = format_price(slots['price'])  # 1400.0 reads as 1400
+    if PHRASING_MODE == "live":
+        return generate_natural_response(TERMINAL_TEMPLATES[key][0].format(currency=CURRENCY, **slots))
+    return phrasing_pool.render(key, **slots)
+
+phrasing_pool = PhrasingPool(rephrase_template, currency=CURRENCY)
+if PHRASING_MODE == "pool":
+    phrasing_pool.warm_up()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,187 @@
+"""
+Async serving mode. Serves the Flask routes from app.py over ASGI, e.g.
+
+    uvicorn asgi_app:application --host 0.0.0.0 --port 5000
+
+Every model call is multiplexed onto one shared AsyncOpenAI client with a pooled,
+keep-alive HTTP connection pool on the event loop. The negotiation logic runs on a bounded
+pool of MAX_CONCURRENT_TURNS turn threads that only wait on the loop, and other routes on a
+small pool of their own so they stay responsive under load. Requests beyond the running and
+queued limits are turned away with 429 and a Retry-After header.
+"""
+import os
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import httpx
+from openai import AsyncOpenAI
+from a2wsgi import WSGIMiddleware
+
+import app as negotiator
+
+# Serving limits
+MAX_CONCURRENT_TURNS = int(os.getenv("MAX_CONCURRENT_TURNS", 256))  # Turns running at once
+MAX_QUEUED_TURNS = int(os.getenv("MAX_QUEUED_TURNS", 256))  # Turns waiting for a free slot before we return 429
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", 64))  # Model calls in flight at once
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", 30))  # Seconds a model call may wait for a slot
+UPSTREAM_KEEPALIVE = int(os.getenv("UPSTREAM_KEEPALIVE", 32))  # Idle connections kept open to the API
+RETRY_AFTER = int(os.getenv("RETRY_AFTER", 2))  # Seconds clients are asked to wait when we are saturated
+OTHER_ROUTE_WORKERS = 4  # Threads serving the routes that don't run turns, like /metrics
+
+# Only these paths run negotiation turns, everything else is let straight through
+TURN_PATHS = ('/initialize', '/chatbot', '/chatbot/stream')
+
+
+class CompletionsBridge:
+    """
+    Exposes the shared async client as the synchronous `chat.completions.create` the
+    negotiation logic calls, running each call on the event loop under the upstream limit.
+    """
+
+    def __init__(self, loop, async_client, limit):
+        self.loop = loop
+        self.async_client = async_client
+        self.limit = limit
+
+    def create(self, **kwargs):
+        if kwargs.get('stream'):
+            return self._stream(kwargs)
+        return self._run(self._create(kwargs))
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _acquire(self):
+        try:
+            await asyncio.wait_for(self.limit.acquire(), UPSTREAM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RuntimeError("Timed out waiting for an upstream slot")
+
+    async def _create(self, kwargs):
+        await self._acquire()
+        try:
+            return await self.async_client.chat.completions.create(**kwargs)
+        finally:
+            self.limit.release()
+
+    async def _open_stream(self, kwargs):
+        await self._acquire()
+        try:
+            return await self.async_client.chat.completions.create(**kwargs)
+        except BaseException:
+            self.limit.release()
+            raise
+
+    @staticmethod
+    async def _next_chunk(chunks):
+        return await chunks.__anext__()
+
+    async def _close_stream(self, stream):
+        try:
+            await stream.close()
+        finally:
+            self.limit.release()
+
+    def _stream(self, kwargs):
+        # Pull the async stream one chunk at a time so tokens reach the caller as they arrive
+        stream = self._run(self._open_stream(kwargs))
+        chunks = stream.__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = self._run(self._next_chunk(chunks))
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        finally:
+            self._run(self._close_stream(stream))
+
+
+class NegotiatorASGI:
+    """
+    ASGI application wrapping the Flask app with admission control.
+    """
+
+    def __init__(self, flask_app):
+        # Each middleware runs the WSGI app on its own thread pool; requests beyond its workers wait in
+        # the pool's queue, which admission control keeps bounded for turns
+        self.turns = WSGIMiddleware(flask_app, workers=MAX_CONCURRENT_TURNS)
+        self.other_routes = WSGIMiddleware(flask_app, workers=OTHER_ROUTE_WORKERS)
+        self.active_turns = 0  # Running plus queued, only touched on the event loop
+        self.async_client = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http' or scope['path'] not in TURN_PATHS or scope['method'] != 'POST':
+            return await self.other_routes(scope, receive, send)
+
+        if self.active_turns >= MAX_CONCURRENT_TURNS + MAX_QUEUED_TURNS:
+            logging.warning(f"Rejecting {scope['path']} with {self.active_turns} turns in progress")
+            return await self.too_many_requests(send)
+        self.active_turns += 1
+        try:
+            await self.turns(scope, receive, send)
+        finally:
+            self.active_turns -= 1
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        loop = asyncio.get_running_loop()
+        self.async_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=0,  # Retries are made by app.upstream_caller, within the turn's deadline
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=UPSTREAM_CONCURRENCY,
+                    max_keepalive_connections=UPSTREAM_KEEPALIVE
+                ),
+                timeout=httpx.Timeout(60.0, connect=5.0)
+            )
+        )
+        # Analysis calls fan out from every running turn, so give them room to match
+        negotiator.analysis_pool = ThreadPoolExecutor(max_workers=2 * MAX_CONCURRENT_TURNS, thread_name_prefix="analysis")
+        bridge = CompletionsBridge(loop, self.async_client, asyncio.Semaphore(UPSTREAM_CONCURRENCY))
+        negotiator.client = SimpleNamespace(chat=SimpleNamespace(completions=bridge))
+        logging.info(
+            f"Async serving mode started: {MAX_CONCURRENT_TURNS} concurrent turns, "
+            f"{MAX_QUEUED_TURNS} queued, {UPSTREAM_CONCURRENCY} upstream calls"
+        )
+
+    async def shutdown(self):
+        negotiator.client = negotiator.openai
+        if self.async_client is not None:
+            await self.async_client.close()
+
+    async def too_many_requests(self, send):
+        body = json.dumps({
+            'response': "We're busy right now, please try again in a moment.",
+            'show_buttons': False
+        }).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 429,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'retry-after', str(RETRY_AFTER).encode()),
+                (b'access-control-allow-origin', b'*'),
+                (b'access-control-expose-headers', b'Retry-After')
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+application = NegotiatorASGI(negotiator.app)
@@ -0,0 +1,105 @@
+"""
+Compares upstream call counts and turn latency between the structured and legacy analysis modes,
+with the model choosing prices, and the structured mode with policy pricing.
+
+Every configuration starts from a fresh intent cache and runs twice: with learning off
+('canonical_only', just the built-in phrases such as "Deal!") to isolate the analysis calls
+themselves, and with learning on ('learned'), where the scripted messages repeat across
+negotiations and are soon answered from the cache.
+
+The OpenAI client is replaced with an in-process stand-in that sleeps for a
+simulated network latency, so no API key is needed.
+
+Usage: python bench_analysis_modes.py [--negotiations N] [--latency SECONDS]
+"""
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from types import SimpleNamespace
+
+import app
+from intent_cache import IntentCache
+from price_extractor import extract_price_locally
+
+USER_SCRIPT = ["Hi!", "That's too much, how about £1,100?", "Could you do 1150?", "I can stretch to 1.2k", "Deal!"]
+
+
+class FakeCompletions:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def create(self, model, messages, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        system = messages[0]['content'] if messages[0]['role'] == 'system' else ''
+        text = messages[-1]['content']
+        decided = re.search(r"Offer exactly ([\d.]+)", ' '.join(m['content'] for m in messages if m['role'] == 'system'))
+        if 'response_format' in kwargs:
+            intent = "acceptance" if "deal" in text.lower() else "negotiation"
+            reply = json.dumps({"intent": intent, "price": extract_price_locally(text).price, "confidence": 0.9})
+        elif 'extracts the latest price' in system:
+            price = extract_price_locally(text).price
+            reply = str(price) if price is not None else "No price found"
+        elif 'classifies' in system:
+            reply = "acceptance" if "deal" in text.lower() else "negotiation"
+        elif text.startswith('Please rephrase'):
+            reply = text
+        elif decided:
+            reply = f"How about £{decided.group(1)}?"
+        else:
+            reply = f"How about £{1450 - 30 * len(messages)}?"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+
+def run_mode(mode, pricing, negotiations, latency, learn):
+    completions = FakeCompletions(latency)
+    app.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    app.intent_cache = IntentCache() if learn else IntentCache(max_entries=0)
+    app.ANALYSIS_MODE = mode
+    app.PRICING_MODE = pricing
+    turn_latencies = []
+    for _ in range(negotiations):
+        state = app.new_negotiation_state()
+        for i, message in enumerate(USER_SCRIPT):
+            start = time.perf_counter()
+            if i == 0:
+                app.initialize_openai_response(state, message)
+            else:
+                app.get_openai_response(state, message)
+            turn_latencies.append(time.perf_counter() - start)
+    turn_latencies.sort()
+    return {
+        'turns': len(turn_latencies),
+        'upstream_calls': completions.calls,
+        'calls_per_turn': round(completions.calls / len(turn_latencies), 2),
+        'mean_turn_latency_ms': round(1000 * sum(turn_latencies) / len(turn_latencies), 1),
+        'p95_turn_latency_ms': round(1000 * turn_latencies[int(0.95 * (len(turn_latencies) - 1))], 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--negotiations', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.2, help="mean simulated upstream latency in seconds")
+    args = parser.parse_args()
+
+    results = {
+        f"{mode}_{pricing}_pricing": {
+            cache: run_mode(mode, pricing, args.negotiations, args.latency, learn)
+            for cache, learn in (("canonical_only", False), ("learned", True))
+        }
+        for mode, pricing in (("legacy", "model"), ("structured", "model"), ("structured", "policy"))
+    }
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
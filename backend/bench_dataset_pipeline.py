@@ -0,0 +1,117 @@
+"""
+Throughput benchmark for dataset_pipeline.py. Generates synthetic negotiation conversations
+from the seed data, with a share of duplicates and malformed lines, and runs the pipeline
+over them at each corpus size and process count, reporting examples/s, MB/s and the peak
+memory of the coordinating process.
+
+Usage: python bench_dataset_pipeline.py [--sizes 20000 100000] [--processes 1 4]
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+from dataset_pipeline import run_pipeline
+from simulator import SEED_DATA, OFFER_TEMPLATES
+from phrasing import TERMINAL_TEMPLATES
+
+SYSTEM_PROMPT = "You are a friendly British price negotiator working for Elite Wheels. You are selling a set of 4 wheels for 1500 £."
+
+
+def load_pairs(path=SEED_DATA):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line)['messages'] for line in f if line.strip()]
+
+
+def synthetic_conversation(rng, pairs):
+    """A negotiation with seed small talk, a few rounds of offers and a closing message."""
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}] + list(rng.choice(pairs))
+    offer, price = rng.randrange(900, 1200, 10), rng.randrange(1400, 1470, 5)
+    for _ in range(rng.randint(1, 8)):
+        messages.append({"role": "user", "content": rng.choice(OFFER_TEMPLATES).format(offer)})
+        messages.append({"role": "assistant", "content": f"I appreciate the offer, but the best I can do is £{price:,}. How does that sound?"})
+        offer, price = offer + rng.randrange(20, 60, 10), max(1200, price - rng.randrange(10, 50, 5))
+    if rng.random() < 0.6:
+        messages.append({"role": "user", "content": "Deal!"})
+        closing = rng.choice(TERMINAL_TEMPLATES['deal_closed']).format(price=price, currency="£", code="ABC123")
+    else:
+        messages.append({"role": "user", "content": "No Deal!"})
+        closing = rng.choice(TERMINAL_TEMPLATES['rejection'])
+    messages.append({"role": "assistant", "content": closing})
+    return {"messages": messages}
+
+
+def write_corpus(path, size, seed=0, duplicate_rate=0.1, invalid_rate=0.01):
+    rng = random.Random(seed)
+    pairs = load_pairs()
+    written = []
+    with open(path, 'w', encoding='utf-8') as f:
+        for _ in range(size):
+            roll = rng.random()
+            if roll < invalid_rate:
+                f.write(rng.choice(('{"messages": [', '{"messages": []}', '{"messages": [{"role": "user", "content": "hi"}]}')) + '\n')
+                continue
+            if roll < invalid_rate + duplicate_rate and written:
+                # Near-identical copy: same conversation with different case and spacing
+                record = json.loads(rng.choice(written))
+                record['messages'][-1]['content'] = '  ' + record['messages'][-1]['content'].upper()
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                continue
+            line = json.dumps(synthetic_conversation(rng, pairs), ensure_ascii=False)
+            if len(written) < 1000:
+                written.append(line)
+            f.write(line + '\n')
+    return os.path.getsize(path)
+
+
+def _measure(queue, corpus, output, processes):
+    manifest = run_pipeline([corpus], output, processes=processes)
+    queue.put({**manifest, 'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)})
+
+
+def measure(corpus, output, processes):
+    """Runs the pipeline in a fresh process so its peak memory is its own."""
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(queue, corpus, output, processes))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20000, 100000], help="conversations per corpus")
+    parser.add_argument('--processes', type=int, nargs='+', default=sorted({1, os.cpu_count()}))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            corpus = os.path.join(directory, f"corpus-{size}.jsonl")
+            corpus_bytes = write_corpus(corpus, size, args.seed)
+            for processes in args.processes:
+                manifest = measure(corpus, os.path.join(directory, f"out-{size}-{processes}"), processes)
+                results.append({
+                    'conversations': size,
+                    'corpus_mb': round(corpus_bytes / 1e6, 1),
+                    'processes': processes,
+                    'elapsed_s': manifest['elapsed_s'],
+                    'examples_per_s': manifest['examples_per_s'],
+                    'mb_per_s': manifest['mb_per_s'],
+                    'peak_rss_mb': manifest['peak_rss_mb'],
+                    'kept': manifest['kept'],
+                    'dropped': manifest['dropped']
+                })
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
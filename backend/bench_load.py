@@ -0,0 +1,206 @@
+"""
+Load generator for the negotiation API. Drives /initialize and /chatbot (or /chatbot/stream)
+through full negotiations at a chosen concurrency and writes machine-readable results.
+
+    python mock_openai.py --port 8001 &
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=mock python app.py &
+    python bench_load.py --concurrency 20 --negotiations 200 --mock-url http://127.0.0.1:8001
+
+With --mock-url the upstream call counts come from the stand-in's /stats endpoint.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ERROR_REPLY = "Sorry, something went wrong!"
+MAX_TURNS = 15
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def post_json(url, body, timeout):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def post_stream(url, body, timeout):
+    """Posts to the SSE endpoint and returns (seconds to first token, final payload)."""
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    first_token = None
+    event = None
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        for raw in response:
+            line = raw.decode().rstrip('\n')
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:'):
+                if event == 'token' and first_token is None:
+                    first_token = time.perf_counter() - start
+                elif event == 'done':
+                    return first_token, json.loads(line[5:])
+    raise RuntimeError("Stream ended without a done event")
+
+
+class Buyer:
+    """Scripted buyer who opens low and raises the offer until the negotiator agrees."""
+
+    def __init__(self, rng):
+        self.offer = rng.randrange(950, 1150, 10)
+        self.step = rng.choice((20, 30, 50))
+        self.limit = rng.randrange(1250, 1450, 10)
+        self.rng = rng
+
+    def next_message(self, last_price, show_buttons):
+        if show_buttons:
+            return "Deal!" if last_price is not None and last_price <= self.limit else "No Deal!"
+        if last_price is not None and last_price <= self.limit and self.rng.random() < 0.3:
+            return "Deal!"
+        message = self.rng.choice(("How about £{:,}?", "I can do {} GBP.", "Would you take {}?", "My best is £{:,}"))
+        text = message.format(self.offer)
+        self.offer = min(self.offer + self.step, self.limit)
+        return text
+
+
+class LoadTest:
+    def __init__(self, base_url, timeout, stream):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.turn_latencies = []
+        self.first_token_latencies = []
+        self.turns = 0
+        self.failures = 0
+        self.rejected = 0  # 429 responses
+        self.completed = 0
+        self.deals = 0
+
+    def turn(self, path, body):
+        start = time.perf_counter()
+        first_token = None
+        try:
+            if self.stream:
+                first_token, payload = post_stream(f"{self.base_url}/chatbot/stream", {**body, 'initialize': path == '/initialize'}, self.timeout)
+            else:
+                payload = post_json(f"{self.base_url}{path}", body, self.timeout)
+        except urllib.error.HTTPError as e:
+            with self.lock:
+                self.turns += 1
+                self.failures += 1
+                self.rejected += e.code == 429
+            return None
+        except Exception:
+            with self.lock:
+                self.turns += 1
+                self.failures += 1
+            return None
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.turns += 1
+            self.turn_latencies.append(elapsed)
+            if first_token is not None:
+                self.first_token_latencies.append(first_token)
+            if payload.get('response') == ERROR_REPLY:
+                self.failures += 1
+        return payload
+
+    def negotiate(self, seed):
+        rng = random.Random(seed)
+        buyer = Buyer(rng)
+        payload = self.turn('/initialize', {'message': "Hi!"})
+        if payload is None:
+            return
+        session_id = payload.get('session_id')
+        for _ in range(MAX_TURNS):
+            message = buyer.next_message(payload.get('last_negotiated_price'), payload.get('show_buttons'))
+            payload = self.turn('/chatbot', {'message': message, 'session_id': session_id})
+            if payload is None:
+                return
+            session_id = payload.get('session_id', session_id)
+            if payload.get('deal_price') is not None:
+                with self.lock:
+                    self.deals += 1
+            if payload.get('negotiation_closed'):
+                break
+        with self.lock:
+            self.completed += 1
+
+
+def mock_stats(mock_url):
+    with urllib.request.urlopen(f"{mock_url.rstrip('/')}/stats") as response:
+        return json.loads(response.read())
+
+
+def reset_mock(mock_url):
+    request = urllib.request.Request(f"{mock_url.rstrip('/')}/stats/reset", data=b'{}', headers={'Content-Type': 'application/json'})
+    urllib.request.urlopen(request).close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="backend base URL")
+    parser.add_argument('--mock-url', help="base URL of mock_openai.py, to count upstream calls")
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--negotiations', type=int, default=100)
+    parser.add_argument('--stream', action='store_true', help="use /chatbot/stream and report time to first token")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results JSON here as well as to stdout")
+    args = parser.parse_args()
+
+    if args.mock_url:
+        reset_mock(args.mock_url)
+    test = LoadTest(args.url, args.timeout, args.stream)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(test.negotiate, range(args.seed, args.seed + args.negotiations)))
+    elapsed = time.perf_counter() - start
+
+    def ms(value):
+        return round(1000 * value, 1) if value is not None else None
+
+    results = {
+        'mode': 'stream' if args.stream else 'json',
+        'concurrency': args.concurrency,
+        'negotiations': args.negotiations,
+        'completed_negotiations': test.completed,
+        'deals': test.deals,
+        'turns': test.turns,
+        'elapsed_s': round(elapsed, 2),
+        'turns_per_s': round(test.turns / elapsed, 2),
+        'negotiations_per_s': round(test.completed / elapsed, 3),
+        'turn_latency_ms': {q: ms(percentile(test.turn_latencies, v)) for q, v in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))},
+        'failure_rate': round(test.failures / test.turns, 4) if test.turns else None,
+        'rejected_429': test.rejected
+    }
+    if args.stream:
+        results['first_token_ms'] = {q: ms(percentile(test.first_token_latencies, v)) for q, v in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))}
+    if args.mock_url:
+        stats = mock_stats(args.mock_url)
+        results['upstream_calls'] = stats['calls']
+        results['upstream_calls_per_turn'] = round(stats['total_calls'] / test.turns, 2) if test.turns else None
+        results['upstream_errors'] = stats['errors']
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Benchmarks the local price extractor against the labeled corpus in price_corpus.jsonl.
+
+Usage: python bench_price_extractor.py [--repeat N]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+from price_extractor import extract_price_locally, LOCAL_PRICE_CONFIDENCE
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "price_corpus.jsonl")
+
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200, help="passes over the corpus when timing")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    resolved = correct = 0
+    mistakes = []
+    for example in corpus:
+        result = extract_price_locally(example['message'])
+        if result.confidence < LOCAL_PRICE_CONFIDENCE:
+            continue  # Would go to the model
+        resolved += 1
+        if result.price == example['price']:
+            correct += 1
+        else:
+            mistakes.append((example['message'], example['price'], result))
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for example in corpus:
+            extract_price_locally(example['message'])
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        'examples': len(corpus),
+        'resolved_locally': resolved,
+        'resolved_locally_share': round(resolved / len(corpus), 3),
+        'local_accuracy': round(correct / resolved, 3) if resolved else None,
+        'extractions_per_second': round(args.repeat * len(corpus) / elapsed)
+    }, indent=2))
+    for message, expected, result in mistakes:
+        print(f"MISMATCH {message!r}: expected {expected}, got {result}", file=sys.stderr)
+    return 1 if mistakes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Measures what timeouts, retries, hedging and circuit breaking do to turn latency when the
+upstream misbehaves. Starts mock_openai.py in-process with injected errors and hung calls,
+points the backend at it through the real OpenAI client and runs the same seeded
+negotiations under each upstream configuration:
+
+    unprotected        no timeout, retry or breaker (how calls were made before)
+    retries            per-call timeout, jittered retries and the circuit breaker
+    retries_hedged     as retries, plus a hedged duplicate of slow negotiation completions
+
+Reports turn latency percentiles, fallback replies, upstream calls and the p95/p99
+reduction against the unprotected run.
+
+Usage: python bench_upstream.py [--negotiations 60] [--hang-rate 0.03] [--error-rate 0.03]
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Hand-written phrasings and no transcripts, so only the turns' own calls reach the stand-in
+os.environ['PHRASING_POOL_SIZE'] = '0'
+os.environ['TRANSCRIPT_LOG'] = '0'
+
+import openai
+
+import app
+import metrics
+import upstream
+from bench_load import percentile
+from intent_cache import IntentCache
+from mock_openai import MockState, parse_latency, serve
+from simulator import Buyer, PERSONAS, load_seed_utterances
+
+
+def configurations(args):
+    unlimited = upstream.CircuitBreaker(threshold=10 ** 9)
+    return {
+        'unprotected': lambda: upstream.UpstreamCaller(timeout=None, retries=0, hedge_after=0, breaker=unlimited),
+        'retries': lambda: upstream.UpstreamCaller(timeout=args.timeout, retries=2, hedge_after=0),
+        'retries_hedged': lambda: upstream.UpstreamCaller(timeout=args.timeout, retries=2, hedge_after=args.hedge_after)
+    }
+
+
+def run_negotiation(seed, utterances, latencies):
+    rng = random.Random(seed)
+    buyer = Buyer(rng.choice(sorted(PERSONAS)), rng, app.ACTUAL_PRICE, utterances)
+    state = app.new_negotiation_state()
+    response = None
+    while not state['negotiation_closed'] and buyer.turns < 12:
+        start = time.perf_counter()
+        upstream.begin_turn()  # As the routes do before each turn
+        if response is None:
+            response = app.initialize_openai_response(state, buyer.opener())
+        else:
+            response = app.get_openai_response(state, buyer.next_message(response['last_negotiated_price'], response['show_buttons']))
+        latencies.append(time.perf_counter() - start)
+
+
+def run_configuration(name, make_caller, args, mock_state, utterances):
+    app.upstream_caller = make_caller()
+    app.intent_cache = IntentCache()  # Start every run equally cold
+    mock_state.reset()
+    fallbacks_before = metrics.FALLBACKS.value(kind='negotiation_template')
+    errors_before = metrics.ERRORS.value(kind='negotiation')
+    hedges_before = metrics.UPSTREAM_HEDGES.value(purpose='negotiation', result='sent')
+    latencies = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda seed: run_negotiation(seed, utterances, latencies), range(args.seed, args.seed + args.negotiations)))
+    elapsed = time.perf_counter() - start
+    stats = mock_state.stats()
+
+    def ms(q):
+        return round(1000 * percentile(latencies, q), 1)
+
+    return {
+        'turns': len(latencies),
+        'elapsed_s': round(elapsed, 2),
+        'turn_latency_ms': {'p50': ms(0.5), 'p95': ms(0.95), 'p99': ms(0.99), 'max': round(1000 * max(latencies), 1)},
+        'failed_negotiation_calls': metrics.ERRORS.value(kind='negotiation') - errors_before,
+        'template_fallbacks': metrics.FALLBACKS.value(kind='negotiation_template') - fallbacks_before,
+        'hedges_sent': metrics.UPSTREAM_HEDGES.value(purpose='negotiation', result='sent') - hedges_before,
+        'upstream_calls': stats['total_calls'],
+        'injected_errors': stats['errors'],
+        'injected_hangs': stats['hangs'],
+        'breaker_state': app.upstream_caller.breaker.state
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--negotiations', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', default='lognormal:0.2:0.5', help="stand-in latency, as for mock_openai.py")
+    parser.add_argument('--error-rate', type=float, default=0.03)
+    parser.add_argument('--hang-rate', type=float, default=0.03)
+    parser.add_argument('--hang-seconds', type=float, default=5.0)
+    parser.add_argument('--timeout', type=float, default=1.0, help="per-attempt timeout of the protected runs")
+    parser.add_argument('--hedge-after', type=float, default=0.4, help="seconds before the hedged run sends a duplicate")
+    parser.add_argument('--port', type=int, default=8011)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results JSON here as well as to stdout")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    mock_state = MockState(parse_latency(args.latency), args.error_rate, args.hang_rate, args.hang_seconds, stream_delay=0.0)
+    server = serve(args.port, mock_state)
+    app.client = openai.OpenAI(base_url=f"http://127.0.0.1:{args.port}/v1", api_key="mock", max_retries=0)
+    app.PHRASING_MODE = "pool"
+    utterances = load_seed_utterances()
+
+    results = {'config': vars(args), 'runs': {}}
+    for name, make_caller in configurations(args).items():
+        random.seed(args.seed)  # Same injected faults for every configuration, as far as thread timing allows
+        results['runs'][name] = run_configuration(name, make_caller, args, mock_state, utterances)
+    server.shutdown()
+
+    baseline = results['runs']['unprotected']['turn_latency_ms']
+    for name, run in results['runs'].items():
+        run['p95_reduction'] = round(1 - run['turn_latency_ms']['p95'] / baseline['p95'], 3)
+        run['p99_reduction'] = round(1 - run['turn_latency_ms']['p99'] / baseline['p99'], 3)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
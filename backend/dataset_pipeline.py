@@ -0,0 +1,294 @@
+"""
+Streaming pipeline that turns chat-format JSONL (like polite_negotiator_data.jsonl) into
+fine-tuning shards:
+
+    python dataset_pipeline.py ../polite_negotiator_data.jsonl mined/*.jsonl --output dataset \
+        --max-tokens 4096 --outcome deal --outcome open --val-ratio 0.05 --processes 8
+
+Each line is validated against the chat fine-tuning format, token-counted, filtered by
+length and outcome and deduplicated on a hash of its normalised text. Kept examples go to
+train-NNNNN.jsonl / val-NNNNN.jsonl shards, with the split decided by that hash, so the
+same conversation always lands in the same split. A manifest.json records the counts.
+
+Input is read in chunks with a bounded number in flight, so memory doesn't grow with
+file size apart from the dedupe index of one 64-bit hash per kept conversation.
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+from collections import Counter, deque
+
+from history import count_message_tokens
+
+ROLES = ("system", "user", "assistant")
+MESSAGE_KEYS = {"role", "content", "name", "weight"}
+OUTCOMES = ("deal", "no_deal", "open")
+
+# Closing phrases of the negotiator's terminal messages, see phrasing.TERMINAL_TEMPLATES
+DEAL_PATTERN = re.compile(r"discount code|deal closed|we have a deal|it's a deal", re.IGNORECASE)
+NO_DEAL_PATTERN = re.compile(r"no deal|couldn't (?:reach|agree|meet)|didn't manage to reach", re.IGNORECASE)
+
+DEFAULT_OPTIONS = {
+    'min_tokens': 0,
+    'max_tokens': 16384,
+    'outcomes': None,  # None keeps every outcome
+    'mask_numbers': False
+}
+
+_options = DEFAULT_OPTIONS  # Set in worker processes by init_worker
+
+
+class InvalidExample(ValueError):
+    pass
+
+
+def validate_example(record):
+    """
+    Checks a record against the chat fine-tuning format and returns its messages.
+    Raises InvalidExample with the reason when it doesn't conform.
+    """
+    if not isinstance(record, dict):
+        raise InvalidExample("not an object")
+    messages = record.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise InvalidExample("no messages")
+    for i, message in enumerate(messages):
+        if not isinstance(message, dict) or message.get("role") not in ROLES:
+            raise InvalidExample("bad role")
+        if not isinstance(message.get("content"), str) or not message["content"].strip():
+            raise InvalidExample("empty content")
+        if set(message) - MESSAGE_KEYS:
+            raise InvalidExample("unexpected message keys")
+        if message["role"] == "system" and i > 0:
+            raise InvalidExample("system message after the first")
+    if not any(message["role"] == "user" for message in messages):
+        raise InvalidExample("no user message")
+    if messages[-1]["role"] != "assistant":
+        raise InvalidExample("does not end with an assistant message")
+    return messages
+
+
+def infer_outcome(record, messages):
+    """Returns the record's outcome field, or infers it from the negotiator's last reply."""
+    outcome = record.get("outcome")
+    if outcome in OUTCOMES:
+        return outcome
+    last_reply = messages[-1]["content"]
+    if DEAL_PATTERN.search(last_reply):
+        return "deal"
+    if NO_DEAL_PATTERN.search(last_reply):
+        return "no_deal"
+    return "open"
+
+
+def normalize_text(text, mask_numbers=False):
+    """Lower-cases and strips punctuation and spacing so trivially different copies hash alike."""
+    text = text.lower().replace('’', "'")
+    if mask_numbers:
+        text = re.sub(r"\d+(?:[.,]\d+)*", "0", text)
+    text = re.sub(r"[^\w\s]", "", text)
+    return " ".join(text.split())
+
+
+def conversation_hash(messages, mask_numbers=False):
+    """Returns a 64-bit hash of a conversation's normalised text."""
+    digest = hashlib.blake2b(digest_size=8)
+    for message in messages:
+        digest.update(f"{message['role']}:{normalize_text(message['content'], mask_numbers)}\n".encode())
+    return int.from_bytes(digest.digest(), 'big')
+
+
+def process_line(line, options):
+    """
+    Processes one input line. Returns ('keep', hash, tokens, outcome, output_line) or
+    ('drop', reason).
+    """
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return ('drop', "invalid json")
+    try:
+        messages = validate_example(record)
+    except InvalidExample as e:
+        return ('drop', f"invalid: {e}")
+
+    tokens = count_message_tokens(messages)
+    if tokens < options['min_tokens']:
+        return ('drop', "too short")
+    if tokens > options['max_tokens']:
+        return ('drop', "too long")
+    outcome = infer_outcome(record, messages)
+    if options['outcomes'] and outcome not in options['outcomes']:
+        return ('drop', f"outcome {outcome}")
+    # Shards only carry the fields the fine-tuning API reads
+    output_line = json.dumps({"messages": messages}, ensure_ascii=False)
+    return ('keep', conversation_hash(messages, options['mask_numbers']), tokens, outcome, output_line)
+
+
+def init_worker(options):
+    global _options
+    _options = options
+
+
+def process_chunk(lines):
+    return [process_line(line, _options) for line in lines]
+
+
+def read_chunks(paths, chunk_size):
+    """Yields (bytes read, lines) chunks of the non-blank lines of the input files."""
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            lines, size = [], 0
+            for line in f:
+                size += len(line)
+                if line.strip():
+                    lines.append(line)
+                if len(lines) >= chunk_size:
+                    yield size, lines
+                    lines, size = [], 0
+            if lines or size:
+                yield size, lines
+
+
+class ShardWriter:
+    """Writes lines to numbered JSONL shards of at most shard_size lines each."""
+
+    def __init__(self, directory, prefix, shard_size):
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.shards = []
+        self._file = None
+        self._count = 0
+
+    def write(self, line):
+        if self._file is None or self._count >= self.shard_size:
+            self._open_next()
+        self._file.write(line + '\n')
+        self._count += 1
+
+    def _open_next(self):
+        self.close()
+        path = os.path.join(self.directory, f"{self.prefix}-{len(self.shards):05d}.jsonl")
+        self._file = open(path, 'w', encoding='utf-8')
+        self._count = 0
+        self.shards.append(os.path.basename(path))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _ordered_results(chunks, pool, processes):
+    """Maps process_chunk over the chunks in order, keeping at most 2 * processes chunks in flight."""
+    if pool is None:
+        for size, lines in chunks:
+            yield size, process_chunk(lines)
+        return
+    pending = deque()
+    for size, lines in chunks:
+        pending.append((size, pool.apply_async(process_chunk, (lines,))))
+        if len(pending) >= 2 * processes:
+            size, result = pending.popleft()
+            yield size, result.get()
+    while pending:
+        size, result = pending.popleft()
+        yield size, result.get()
+
+
+def run_pipeline(paths, output, options=None, val_ratio=0.05, shard_size=50000, processes=1, chunk_size=2000):
+    """
+    Runs the pipeline over the input files and writes shards and manifest.json to output.
+    Returns the manifest.
+    """
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    os.makedirs(output, exist_ok=True)
+    writers = {'train': ShardWriter(output, 'train', shard_size), 'val': ShardWriter(output, 'val', shard_size)}
+    seen = set()
+    dropped = Counter()
+    kept = Counter()
+    tokens = Counter()
+    outcomes = Counter()
+    lines_read = bytes_read = 0
+
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(options,)) if processes > 1 else None
+    if pool is None:
+        init_worker(options)
+    try:
+        for size, results in _ordered_results(read_chunks(paths, chunk_size), pool, processes):
+            bytes_read += size
+            lines_read += len(results)
+            for result in results:
+                if result[0] == 'drop':
+                    dropped[result[1]] += 1
+                    continue
+                _, key, count, outcome, line = result
+                if key in seen:
+                    dropped["duplicate"] += 1
+                    continue
+                seen.add(key)
+                split = 'val' if (key % 10000) < val_ratio * 10000 else 'train'
+                writers[split].write(line)
+                kept[split] += 1
+                tokens[split] += count
+                outcomes[outcome] += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for writer in writers.values():
+            writer.close()
+    elapsed = time.perf_counter() - start
+
+    manifest = {
+        'inputs': [os.path.abspath(path) for path in paths],
+        'options': {**options, 'outcomes': sorted(options['outcomes']) if options['outcomes'] else None, 'val_ratio': val_ratio, 'shard_size': shard_size},
+        'lines_read': lines_read,
+        'kept': dict(kept),
+        'tokens': dict(tokens),
+        'outcomes': dict(outcomes),
+        'dropped': dict(sorted(dropped.items())),
+        'shards': {split: writer.shards for split, writer in writers.items()},
+        'elapsed_s': round(elapsed, 2),
+        'examples_per_s': round(lines_read / elapsed, 1) if elapsed else None,
+        'mb_per_s': round(bytes_read / elapsed / 1e6, 2) if elapsed else None
+    }
+    with open(os.path.join(output, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help="chat-format JSONL files")
+    parser.add_argument('--output', required=True, help="directory for the shards and manifest.json")
+    parser.add_argument('--min-tokens', type=int, default=DEFAULT_OPTIONS['min_tokens'])
+    parser.add_argument('--max-tokens', type=int, default=DEFAULT_OPTIONS['max_tokens'])
+    parser.add_argument('--outcome', action='append', choices=OUTCOMES, help="keep only this outcome (repeatable)")
+    parser.add_argument('--mask-numbers', action='store_true', help="treat conversations differing only in numbers as duplicates")
+    parser.add_argument('--val-ratio', type=float, default=0.05)
+    parser.add_argument('--shard-size', type=int, default=50000, help="examples per shard")
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=2000, help="lines per unit of work")
+    args = parser.parse_args()
+
+    options = {
+        'min_tokens': args.min_tokens,
+        'max_tokens': args.max_tokens,
+        'outcomes': set(args.outcome) if args.outcome else None,
+        'mask_numbers': args.mask_numbers
+    }
+    manifest = run_pipeline(args.inputs, args.output, options, args.val_ratio, args.shard_size, args.processes, args.chunk_size)
+    print(json.dumps(manifest, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import os
+import re
+import logging
+from collections import Counter
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1200))  # Prompt tokens allowed for the negotiation completion
+
+# Chat format overheads, as documented for OpenAI chat models
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Rough split of text into model tokens: short digit groups, word pieces and single symbols
+TOKEN_PATTERN = re.compile(r"\d{1,3}|[A-Za-z]+|'[a-z]+|[^\sA-Za-z\d]")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text):
+    """
+    Counts the tokens in a piece of text, exactly with tiktoken when installed, otherwise
+    with a local approximation that is within a few percent for English chat text.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # Long words are split into several tokens by the model's BPE vocabulary
+    pieces = TOKEN_PATTERN.findall(text)
+    return len(pieces) + sum((len(piece) - 1) // 7 for piece in pieces if len(piece) > 7)
+
+
+def count_message_tokens(messages):
+    """Counts the prompt tokens a list of chat messages costs."""
+    return sum(TOKENS_PER_MESSAGE + count_tokens(message['role']) + count_tokens(message['content']) for message in messages) + TOKENS_PER_REPLY
+
+
+def _format_prices(prices, currency):
+    return ", ".join(f"{currency}{price:,.0f}" if price == int(price) else f"{currency}{price:,.2f}" for price in prices)
+
+
+def summarize_negotiation(user_offers, bot_offers, omitted, currency, brief=False):
+    """
+    Summarises the negotiation facts carried by the omitted turns. The summary has the same
+    few lines however long the negotiation, and brief=True keeps only the latest positions.
+    """
+    lines = [f"Summary of the earlier negotiation ({omitted} older messages omitted):"]
+    if not user_offers:
+        lines.append("- The user hasn't offered a price yet.")
+    elif brief or len(user_offers) == 1:
+        lines.append(f"- The user's latest offer is {_format_prices(user_offers[-1:], currency)}.")
+    else:
+        lines.append(
+            f"- The user has made {len(user_offers)} offers, from {_format_prices(user_offers[:1], currency)} "
+            f"to {_format_prices(user_offers[-1:], currency)} (lowest {_format_prices([min(user_offers)], currency)}, "
+            f"highest {_format_prices([max(user_offers)], currency)})."
+        )
+        price, count = Counter(user_offers).most_common(1)[0]
+        if count > 1:
+            lines.append(f"- The user has repeated the offer of {_format_prices([price], currency)} {count} times.")
+    if bot_offers and (brief or len(bot_offers) == 1):
+        lines.append(f"- Your lowest price so far is {_format_prices([min(bot_offers)], currency)}.")
+    elif bot_offers:
+        lines.append(
+            f"- You have made {len(bot_offers)} offers, from {_format_prices(bot_offers[:1], currency)} "
+            f"to {_format_prices(bot_offers[-1:], currency)}; your lowest price so far is {_format_prices([min(bot_offers)], currency)}."
+        )
+    return "\n".join(lines)
+
+
+def window_history(conversation_history, price_state, user_offers, bot_offers, currency, budget=HISTORY_TOKEN_BUDGET):
+    """
+    Builds the prompt for the negotiation completion within a token budget.
+
+    The system prompt, the current price state and the latest message are always sent. Recent
+    turns are kept verbatim, newest first, until the budget runs out; older turns are replaced
+    by a summary of the negotiation facts, shortened or dropped if it doesn't fit. Returns
+    (messages, full_tokens, prompt_tokens) where full_tokens is what the whole history would
+    have cost.
+    """
+    system, turns = conversation_history[:1], conversation_history[1:]
+    state_message = [{"role": "system", "content": price_state}]
+    full_tokens = count_message_tokens(system + turns + state_message)
+    if full_tokens <= budget:
+        return system + turns + state_message, full_tokens, full_tokens
+
+    # Reserve room for the summary, whose size doesn't depend on how many turns it covers
+    summary_reserve = count_message_tokens([{"role": "system", "content": summarize_negotiation(user_offers, bot_offers, len(turns), currency)}])
+    used = count_message_tokens(system + state_message) + summary_reserve - TOKENS_PER_REPLY
+    kept = []
+    for message in reversed(turns):
+        cost = count_message_tokens([message]) - TOKENS_PER_REPLY
+        if kept and used + cost > budget:
+            break
+        kept.append(message)  # The latest message is always kept, even over budget
+        used += cost
+    kept.reverse()
+
+    omitted = len(turns) - len(kept)
+    for brief in (False, True):
+        summary = [{"role": "system", "content": summarize_negotiation(user_offers, bot_offers, omitted, currency, brief)}]
+        messages = system + summary + kept + state_message
+        prompt_tokens = count_message_tokens(messages)
+        if prompt_tokens <= budget:
+            break
+    else:
+        # Only the parts that are always sent are left, so go without a summary
+        messages = system + kept + state_message
+        prompt_tokens = count_message_tokens(messages)
+    logging.info(f"Compacted {omitted} older messages into a summary")
+    return messages, full_tokens, prompt_tokens
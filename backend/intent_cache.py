@@ -0,0 +1,82 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+INTENT_CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", 10000))  # Learned entries kept, least recently used evicted first
+INTENT_CACHE_MIN_CONFIDENCE = float(os.getenv("INTENT_CACHE_MIN_CONFIDENCE", 0.9))  # Only classifications at least this sure are learned
+MAX_CACHED_LENGTH = 200  # Longer messages are practically never repeated, so they aren't worth a slot
+
+# Canonical user replies, including what the Deal / No Deal buttons send. None of them carry a price.
+CANONICAL_USER_PHRASES = {
+    'acceptance': (
+        "deal", "its a deal", "it's a deal", "deal done", "yes", "yes please", "yeah", "yep", "ok", "okay", "ok deal",
+        "sure", "agreed", "i agree", "i accept", "accepted", "sounds good", "fine", "alright", "go on then"
+    ),
+    'rejection': (
+        "no deal", "no", "no thanks", "no thank you", "nope", "not interested", "i'm not interested",
+        "im not interested", "i don't think so", "i dont think so", "not for me"
+    ),
+    'negotiation': (
+        "hi", "hello", "hey", "hiya", "good morning", "good afternoon", "can you go lower", "can you do better",
+        "any discount", "too expensive", "that's too much", "thats too much", "what's your best price", "whats your best price"
+    )
+}
+
+
+def normalize_message(message):
+    """
+    Normalises a message for cache lookups: case, surrounding punctuation and repeated spaces
+    don't change what a reply means. Digits, currency symbols and separators are kept.
+    """
+    text = message.strip().lower().replace('’', "'")
+    text = re.sub(r"[^\w\s'£$€.,-]", '', text)
+    text = re.sub(r"(?<!\d)[.,]|[.,](?!\d)", ' ', text)  # Keep separators only inside numbers like 1,350.00
+    text = re.sub(r"\s+", ' ', text)
+    return text.strip(" .,!?-")
+
+
+class IntentCache:
+    """
+    Memoises (price, intent) per speaker and normalised message.
+    Canonical phrases are permanent; entries learned from confident classifications
+    live in a bounded LRU.
+    """
+
+    def __init__(self, max_entries=INTENT_CACHE_SIZE, min_confidence=INTENT_CACHE_MIN_CONFIDENCE):
+        self.max_entries = max_entries
+        self.min_confidence = min_confidence
+        self._canonical = {
+            ('user', phrase): (None, intent)
+            for intent, phrases in CANONICAL_USER_PHRASES.items()
+            for phrase in phrases
+        }
+        self._learned = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, message, speaker):
+        """Returns the cached (price, intent) for a message, or None."""
+        key = (speaker, normalize_message(message))
+        if key in self._canonical:
+            return self._canonical[key]
+        with self._lock:
+            entry = self._learned.get(key)
+            if entry is not None:
+                self._learned.move_to_end(key)
+            return entry
+
+    def learn(self, message, speaker, price, intent, confidence):
+        """Remembers a classification if it is confident and specific enough to reuse."""
+        if intent == "unknown" or confidence < self.min_confidence:
+            return
+        normalized = normalize_message(message)
+        if not normalized or len(normalized) > MAX_CACHED_LENGTH or (speaker, normalized) in self._canonical:
+            return
+        with self._lock:
+            self._learned[(speaker, normalized)] = (price, intent)
+            self._learned.move_to_end((speaker, normalized))
+            while len(self._learned) > self.max_entries:
+                self._learned.popitem(last=False)
+
+    def __len__(self):
+        return len(self._canonical) + len(self._learned)
@@ -0,0 +1,107 @@
+import re
+import json
+import logging
+
+import metrics
+from price_extractor import extract_price_locally
+
+INTENTS = ("acceptance", "rejection", "negotiation", "unknown")
+
+# JSON schema the structured analysis call must follow
+ANALYSIS_SCHEMA = {
+    "name": "message_analysis",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "intent": {"type": "string", "enum": list(INTENTS)},
+            "price": {"type": ["number", "null"]},
+            "confidence": {"type": "number"}
+        },
+        "required": ["intent", "price", "confidence"],
+        "additionalProperties": False
+    }
+}
+
+INTENT_GUIDELINES = {
+    'user': (
+        "- If the user agrees to the price or says phrases like 'Yes', 'sure', 'Deal', the intent is 'acceptance'.\n"
+        "- If the user declines or says phrases like 'No', 'Not interested', 'I don't think so', the intent is 'rejection'.\n"
+        "- If the user makes a counteroffer (gives a price) or continues negotiating, the intent is 'negotiation'.\n"
+        "- If the intent is unclear, the intent is 'unknown'."
+    ),
+    'assistant': (
+        "- If the assistant accepts the user's offer or says phrases like 'Deal', 'Agreed', 'ok', 'alright', 'We have a deal', the intent is 'acceptance'.\n"
+        "- If the assistant declines the negotiation or says phrases like 'We cannot offer a better price', 'Sorry, that's our final offer', the intent is 'rejection'.\n"
+        "- If the assistant makes a counteroffer, suggests a new price, continues negotiating, or asks the user what it thinks the intent is 'negotiation'.\n"
+        "- If the intent is unclear, the intent is 'unknown'."
+    )
+}
+
+
+def analysis_system_prompt(speaker):
+    """
+    Builds the system prompt asking for the intent and price of a message in one reply.
+    """
+    return (
+        f"You are an assistant that analyses the {speaker}'s latest message in a price negotiation. "
+        f"Classify the {speaker}'s intent as 'acceptance', 'rejection', 'negotiation' or 'unknown', "
+        f"and identify the latest price offered or suggested by the {speaker} as a plain number, or null if there is none. "
+        "Also give your confidence in the intent between 0 and 1. "
+        'Respond only with JSON of the form {"intent": "...", "price": 1234.0, "confidence": 0.9}.\n\n'
+        "Guidelines:\n" + INTENT_GUIDELINES[speaker]
+    )
+
+
+def map_intent(text):
+    """
+    Maps a free-text classification reply onto one of the predefined intents.
+    """
+    intent = text.strip().lower()
+    if "acceptance" in intent:
+        return "acceptance"
+    elif "rejection" in intent:
+        return "rejection"
+    elif "negotiation" in intent:
+        return "negotiation"
+    else:
+        return "unknown"
+
+
+def _as_price(value):
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    return extract_price_locally(str(value)).price
+
+
+def parse_analysis(text):
+    """
+    Parses a structured analysis reply into {intent, price, confidence}.
+    Malformed JSON degrades to the free-text intent mapping and local price extraction.
+    """
+    data = None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # Models sometimes wrap the JSON in prose or code fences
+        match = re.search(r'\{.*\}', text, re.DOTALL)
+        if match:
+            try:
+                data = json.loads(match.group(0))
+            except ValueError:
+                pass
+
+    if not isinstance(data, dict):
+        logging.warning(f"Analysis reply is not JSON, falling back to free-text mapping: {text}")
+        metrics.FALLBACKS.inc(kind='analysis_free_text')
+        return {'intent': map_intent(text), 'price': extract_price_locally(text).price, 'confidence': 0.5}
+
+    intent = data.get('intent')
+    intent = intent.lower() if isinstance(intent, str) and intent.lower() in INTENTS else map_intent(str(intent))
+    try:
+        confidence = min(max(float(data.get('confidence', 0.5)), 0.0), 1.0)
+    except (TypeError, ValueError):
+        confidence = 0.5
+    return {'intent': intent, 'price': _as_price(data.get('price')), 'confidence': confidence}
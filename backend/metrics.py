@@ -0,0 +1,186 @@
+"""
+In-process metrics for the negotiation hot path, rendered in the Prometheus text format.
+
+Each turn gets a TurnTiming holding one span per upstream call (purpose, latency,
+tokens, outcome). Spans recorded on other threads reach the turn as long as the work
+runs in a copy of the turn's context, as app.run_concurrently does.
+"""
+import json
+import time
+import logging
+import threading
+import contextvars
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0)
+
+_current_turn = contextvars.ContextVar('current_turn', default=None)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, '') for name in self.labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = self._values or ({(): 0} if not self.labels else {})
+            for key, value in sorted(values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            series = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labels + ('le',), key + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels + ('le',), key + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+TURNS = Counter('negotiator_turns_total', "Negotiation turns served.", ('endpoint',))
+DEALS_CLOSED = Counter('negotiator_deals_closed_total', "Negotiations closed with a deal.")
+FALLBACKS = Counter('negotiator_fallbacks_total', "Times a degraded or alternative path was taken.", ('kind',))
+INTENT_CACHE = Counter('negotiator_intent_cache_total', "Message analysis lookups in the intent cache.", ('result',))
+ERRORS = Counter('negotiator_errors_total', "Errors by where they happened.", ('kind',))
+TRANSCRIPT_EVENTS = Counter('negotiator_transcript_events_total', "Transcript events written, dropped or failed.", ('result',))
+UPSTREAM_CALLS = Counter('negotiator_upstream_calls_total', "Model calls by purpose and outcome.", ('purpose', 'outcome'))
+UPSTREAM_TOKENS = Counter('negotiator_upstream_tokens_total', "Tokens used by model calls.", ('purpose', 'kind'))
+UPSTREAM_RETRIES = Counter('negotiator_upstream_retries_total', "Model calls retried after a transient error.", ('purpose',))
+UPSTREAM_HEDGES = Counter('negotiator_upstream_hedges_total', "Hedged duplicate model calls sent, and how many of them won.", ('purpose', 'result'))
+CIRCUIT_TRANSITIONS = Counter('negotiator_circuit_transitions_total', "Upstream circuit breaker state changes.", ('state',))
+UPSTREAM_LATENCY = Histogram('negotiator_upstream_latency_seconds', "Model call latency by purpose.", ('purpose',))
+TURN_LATENCY = Histogram('negotiator_turn_latency_seconds', "Whole turn latency by endpoint.", ('endpoint',))
+
+REGISTRY = (TURNS, DEALS_CLOSED, FALLBACKS, INTENT_CACHE, ERRORS, TRANSCRIPT_EVENTS, UPSTREAM_CALLS, UPSTREAM_TOKENS,
+            UPSTREAM_RETRIES, UPSTREAM_HEDGES, CIRCUIT_TRANSITIONS, UPSTREAM_LATENCY, TURN_LATENCY)
+
+
+def render():
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class TurnTiming:
+    """Timing spans of the upstream calls made during one turn."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.spans = []
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def add_span(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.start
+        TURNS.inc(endpoint=self.endpoint)
+        TURN_LATENCY.observe(self.duration, endpoint=self.endpoint)
+        logging.info(f"Turn timing: {json.dumps(self.summary())}")
+
+    def summary(self):
+        return {
+            'endpoint': self.endpoint,
+            'duration_ms': round(1000 * (self.duration or 0), 1),
+            'upstream_calls': len(self.spans),
+            'spans': self.spans
+        }
+
+    def server_timing(self):
+        """Formats the spans as a Server-Timing header value."""
+        entries = [
+            f"{span['purpose']};dur={span['latency_ms']};desc=\"{span['outcome']}\""
+            for span in self.spans
+        ]
+        entries.append(f"total;dur={round(1000 * (self.duration or 0), 1)}")
+        return ', '.join(entries)
+
+
+def begin_turn(endpoint):
+    """Starts timing a turn in the current context."""
+    timing = TurnTiming(endpoint)
+    _current_turn.set(timing)
+    return timing
+
+
+def record_upstream(purpose, seconds, outcome, usage=None):
+    """Records one upstream call in the metrics and in the current turn's spans."""
+    UPSTREAM_CALLS.inc(purpose=purpose, outcome=outcome)
+    UPSTREAM_LATENCY.observe(seconds, purpose=purpose)
+    span = {'purpose': purpose, 'latency_ms': round(1000 * seconds, 1), 'outcome': outcome}
+    if usage is not None:
+        span['prompt_tokens'] = usage.prompt_tokens
+        span['completion_tokens'] = usage.completion_tokens
+        UPSTREAM_TOKENS.inc(usage.prompt_tokens, purpose=purpose, kind='prompt')
+        UPSTREAM_TOKENS.inc(usage.completion_tokens, purpose=purpose, kind='completion')
+    timing = _current_turn.get()
+    if timing is not None:
+        timing.add_span(span)
+
+
+def timed_stream(purpose, stream, start):
+    """Passes a streamed completion through, recording its span once the stream ends."""
+    usage = None
+    first_chunk = None
+    outcome = 'error'
+    try:
+        for chunk in stream:
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - start
+            usage = getattr(chunk, 'usage', None) or usage
+            yield chunk
+        outcome = 'ok'
+    finally:
+        record_upstream(purpose, time.perf_counter() - start, outcome, usage)
+        if first_chunk is not None:
+            UPSTREAM_LATENCY.observe(first_chunk, purpose=f"{purpose}_first_token")
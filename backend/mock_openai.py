@@ -0,0 +1,363 @@
+"""
+Offline stand-in for the OpenAI chat-completions API, for benchmarking without the live model.
+
+    python mock_openai.py --port 8001 --latency lognormal:0.4:0.5 --error-rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=mock python app.py
+
+Replies are templated from what each call is for (negotiation, analysis, price
+extraction, intent classification, rephrasing), or scripted from a JSON file mapping
+those purposes to lists of replies. Latency follows a configurable distribution and
+errors or hung requests can be injected at a given rate. GET /stats returns call
+counts, POST /stats/reset clears them. in_process_client() gives the same replies
+without a server.
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from price_extractor import extract_price_locally
+from history import count_message_tokens, count_tokens
+
+PURPOSES = ('negotiation', 'analysis', 'price', 'intent', 'rephrase')
+ACCEPT_WORDS = ('deal', 'yes', 'sure', 'ok', 'agreed', 'accept', 'fine')
+REJECT_WORDS = ('no deal', 'no thanks', 'not interested', "i don't think so", 'nope')
+
+
+def parse_latency(spec):
+    """
+    Parses a latency distribution into a function returning seconds:
+    "fixed:S", "uniform:LOW:HIGH", "lognormal:MEDIAN:SIGMA" or "exponential:MEAN".
+    """
+    kind, *params = spec.split(':')
+    params = [float(p) for p in params]
+    if kind == 'fixed':
+        return lambda: params[0]
+    elif kind == 'uniform':
+        return lambda: random.uniform(params[0], params[1])
+    elif kind == 'lognormal':
+        median, sigma = params
+        return lambda: median * random.lognormvariate(0, sigma)
+    elif kind == 'exponential':
+        return lambda: random.expovariate(1 / params[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def classify_purpose(body):
+    """Works out which of the backend's calls a request is."""
+    messages = body.get('messages', [])
+    first = messages[0]['content'] if messages else ''
+    if 'response_format' in body:
+        return 'analysis'
+    if messages and messages[0]['role'] == 'system':
+        if 'extracts the latest price' in first:
+            return 'price'
+        if 'classifies' in first:
+            return 'intent'
+        return 'negotiation'
+    return 'rephrase'
+
+
+def guess_intent(text):
+    lowered = text.lower()
+    if any(word in lowered for word in REJECT_WORDS):
+        return 'rejection'
+    if extract_price_locally(text).price is None and any(re.search(rf"\b{word}\b", lowered) for word in ACCEPT_WORDS):
+        return 'acceptance'
+    return 'negotiation'
+
+
+def _number(pattern, text, default):
+    match = re.search(pattern, text)
+    return float(match.group(1).replace(',', '')) if match else default
+
+
+def negotiation_reply(messages):
+    """
+    Counteroffers a little lower each turn, never below the floor from the system prompt,
+    or names the price the backend decided when it gives one.
+    """
+    system = ' '.join(m['content'] for m in messages if m['role'] == 'system')
+    list_price = _number(r"wheels for ([\d,.]+)", system, 1500)
+    floor = _number(r"no less than ([\d,.]+)", system, 1200)
+    current = _number(r"last offered price is ([\d,.]+)", system, _number(r"offering a price of ([\d,.]+)", system, 1450))
+    user_turns = [m['content'] for m in messages if m['role'] == 'user']
+    decided = _number(r"[Oo]ffer exactly ([\d,.]+)", system, None)
+    if decided is not None:
+        # Policy pricing mode: the backend has already decided the price, so just say it
+        if 'less than half' in system:
+            return f"I'm afraid we won't have a deal with this kind of offer, so please try to do better. We're at £{decided:,.0f}."
+        if 'not improved' in system:
+            return f"We're still at £{decided:,.0f}, could you make me a better offer?"
+        return f"I appreciate the offer, but the best I can do is £{decided:,.0f}. How does that sound?"
+    offer = extract_price_locally(user_turns[-1]).price if user_turns else None
+    if len(user_turns) <= 1 and offer is None:
+        return f"Hello! I can offer you this set of 4 wheels for £{current:,.0f}. What do you think?"
+    if offer is not None and offer < 0.5 * list_price:
+        return "I'm afraid we won't have a deal with this kind of offer, so please try to do better."
+    if offer is not None and offer >= current * 0.9 and offer >= floor:
+        return f"Alright, we have a deal at £{offer:,.0f}!"
+    counter = max(floor, round(current - random.choice((20, 30, 40, 50)), -1))
+    return f"I appreciate the offer, but the best I can do is £{counter:,.0f}. How does that sound?"
+
+
+def templated_reply(purpose, messages):
+    text = messages[-1]['content'] if messages else ''
+    if purpose == 'negotiation':
+        return negotiation_reply(messages)
+    if purpose == 'analysis':
+        price = extract_price_locally(text).price
+        return json.dumps({"intent": guess_intent(text), "price": price, "confidence": 0.9})
+    if purpose == 'price':
+        price = extract_price_locally(text).price
+        return str(price) if price is not None else "No price found"
+    if purpose == 'intent':
+        return guess_intent(text)
+    # Rephrase: hand back the quoted text
+    match = re.search(r"'(.*)'\s*$", text, re.DOTALL)
+    return match.group(1) if match else text
+
+
+class MockState:
+    """Configuration and counters shared by the request handlers."""
+
+    def __init__(self, latency, error_rate=0.0, hang_rate=0.0, hang_seconds=30.0, stream_delay=0.02, script=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.stream_delay = stream_delay
+        self.script = script or {}  # purpose -> list of replies, used in turn
+        self._script_positions = {}
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = {purpose: 0 for purpose in PURPOSES}
+            self.errors = 0
+            self.hangs = 0
+
+    def record(self, purpose):
+        with self._lock:
+            self.calls[purpose] += 1
+
+    def reply(self, purpose, messages):
+        replies = self.script.get(purpose)
+        if replies:
+            with self._lock:
+                position = self._script_positions.get(purpose, 0)
+                self._script_positions[purpose] = position + 1
+            return replies[position % len(replies)]
+        return templated_reply(purpose, messages)
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'total_calls': sum(self.calls.values()), 'errors': self.errors, 'hangs': self.hangs}
+
+
+def stream_chunks(content, model, usage=None, delay=0.0):
+    """
+    Yields the chunks of a streamed completion, one word at a time with `delay` seconds between
+    them, then a usage chunk when usage is given.
+    """
+    chunk_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    pieces = re.findall(r"\S+\s*", content)
+    for i, piece in enumerate(pieces + [None]):
+        yield {
+            'id': chunk_id,
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'delta': ({'role': 'assistant', 'content': piece} if i == 0 else {'content': piece}) if piece is not None else {},
+                'finish_reason': None if piece is not None else 'stop'
+            }]
+        }
+        if piece is not None and delay > 0:
+            time.sleep(delay)
+    if usage is not None:
+        # With stream_options.include_usage the API sends usage on a final chunk with no choices
+        yield {'id': chunk_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model, 'choices': [], 'usage': usage}
+
+
+def completion_body(content, model, messages):
+    prompt_tokens = count_message_tokens(messages)
+    completion_tokens = count_tokens(content)
+    return {
+        'id': f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content, 'refusal': None},
+            'logprobs': None,
+            'finish_reason': 'stop'
+        }],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
+    }
+
+
+def _namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_namespace(item) for item in value]
+    return value
+
+
+def _parsed_chunk(chunk):
+    # The client parses the empty final delta with its fields set to None
+    for choice in chunk['choices']:
+        choice['delta'] = {'role': None, 'content': None, **choice['delta']}
+    return _namespace(chunk)
+
+
+class InProcessCompletions:
+    """
+    The stand-in as a drop-in for client.chat.completions, without HTTP, for offline runs
+    that drive the backend's functions directly.
+    """
+
+    def __init__(self, state):
+        self.state = state
+
+    def create(self, model, messages, **kwargs):
+        body = {'model': model, 'messages': messages, **kwargs}
+        purpose = classify_purpose(body)
+        self.state.record(purpose)
+        latency = self.state.latency()
+        if latency > 0:
+            time.sleep(latency)
+        if random.random() < self.state.error_rate:
+            with self.state._lock:
+                self.state.errors += 1
+            raise RuntimeError("Injected failure")
+        content = self.state.reply(purpose, messages)
+        if kwargs.get('stream'):
+            include_usage = (kwargs.get('stream_options') or {}).get('include_usage', False)
+            usage = completion_body(content, model, messages)['usage'] if include_usage else None
+            return (_parsed_chunk(chunk) for chunk in stream_chunks(content, model, usage, self.state.stream_delay))
+        return _namespace(completion_body(content, model, messages))
+
+
+def in_process_client(state):
+    """Returns an object usable as the backend's client, answering from the given MockState."""
+    return SimpleNamespace(chat=SimpleNamespace(completions=InProcessCompletions(state)))
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass  # Keep benchmark output clean
+
+        def send_json(self, status, payload, headers=()):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                return self.send_json(200, state.stats())
+            self.send_json(404, {'error': {'message': 'Not found'}})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/stats/reset':
+                state.reset()
+                return self.send_json(200, state.stats())
+            if not self.path.endswith('/chat/completions'):
+                return self.send_json(404, {'error': {'message': 'Not found'}})
+
+            purpose = classify_purpose(body)
+            state.record(purpose)
+            roll = random.random()
+            if roll < state.hang_rate:
+                with state._lock:
+                    state.hangs += 1
+                time.sleep(state.hang_seconds)
+            else:
+                time.sleep(state.latency())
+            if roll >= 1 - state.error_rate:
+                with state._lock:
+                    state.errors += 1
+                status = random.choice((429, 500, 503))
+                return self.send_json(status, {'error': {'message': 'Injected failure', 'type': 'server_error'}}, [('Retry-After', '1')])
+
+            messages = body.get('messages', [])
+            content = state.reply(purpose, messages)
+            model = body.get('model', 'mock')
+            if body.get('stream'):
+                include_usage = (body.get('stream_options') or {}).get('include_usage', False)
+                return self.stream(content, model, completion_body(content, model, messages)['usage'] if include_usage else None)
+            self.send_json(200, completion_body(content, model, messages))
+
+        def stream(self, content, model, usage=None):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for chunk in stream_chunks(content, model, usage, state.stream_delay):
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def serve(port, state, host='127.0.0.1'):
+    """Starts the stand-in on a background thread and returns the server."""
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-openai', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', default='lognormal:0.4:0.5', help="fixed:S, uniform:LOW:HIGH, lognormal:MEDIAN:SIGMA or exponential:MEAN")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of calls answered with 429/500/503")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="share of calls that stall for --hang-seconds")
+    parser.add_argument('--hang-seconds', type=float, default=30.0)
+    parser.add_argument('--stream-delay', type=float, default=0.02, help="seconds between streamed chunks")
+    parser.add_argument('--script', help="JSON file mapping purposes (%s) to lists of replies" % ', '.join(PURPOSES))
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, encoding='utf-8') as f:
+            script = json.load(f)
+    state = MockState(parse_latency(args.latency), args.error_rate, args.hang_rate, args.hang_seconds, args.stream_delay, script)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"Mock OpenAI API listening on http://{args.host}:{args.port}/v1", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import os
+import time
+import random
+import string
+import logging
+import threading
+
+PHRASING_POOL_SIZE = int(os.getenv("PHRASING_POOL_SIZE", 6))  # Model-generated variants kept per template
+PHRASING_TTL = int(os.getenv("PHRASING_TTL", 6 * 3600))  # Seconds before generated variants are regenerated
+PHRASING_RETRY_DELAY = 60  # Seconds to wait before trying again after a refresh produced nothing
+
+# Fixed messages sent when a negotiation ends, plus the counteroffer used when a model reply
+# names the wrong price. The first phrasing of each is the canonical template, the rest are
+# hand-written variants that are always available so a reply never has to wait for the model.
+TERMINAL_TEMPLATES = {
+    'deal_closed': [
+        "Deal closed! We've accepted your offer of {price} {currency}. Here's your discount code: {code}. Thank you for negotiating with us!",
+        "Brilliant, we have a deal at {price} {currency}! Your discount code is {code}. Thanks so much for haggling with us!",
+        "Lovely, {price} {currency} it is! Use the discount code {code} at checkout. Thanks for negotiating with us!",
+        "That's a deal at {price} {currency}. Here's your discount code: {code}. Cheers for negotiating with us!"
+    ],
+    'rejection': [
+        "Sorry that we couldn't reach an agreement. Better luck next time!",
+        "Shame we couldn't agree on a price this time. Hopefully we'll do business another day!",
+        "No worries, sorry we couldn't meet in the middle. Do come back if you change your mind!"
+    ],
+    'max_attempts': [
+        "We've reached the maximum negotiation attempts. Our final price is {price} {currency}.",
+        "We've gone back and forth as far as we can, I'm afraid. Our final price is {price} {currency}.",
+        "That's as many rounds as we can do. The best we can offer is {price} {currency}."
+    ],
+    'ended': [
+        "The negotiation has ended. No more offers can be made.",
+        "This negotiation is now closed, so we can't take any more offers.",
+        "We've wrapped up this negotiation, I'm afraid no more offers can be made."
+    ],
+    'no_deal': [
+        "No deal reached. Thank you for your time!",
+        "We didn't manage to reach a deal, but thanks for your time!"
+    ],
+    'counteroffer': [
+        "The best I can do is {price} {currency}. How does that sound?",
+        "I can offer you the set for {price} {currency}. What do you think?",
+        "How about {price} {currency}? That's a really good price for these wheels."
+    ]
+}
+
+
+def template_fields(template):
+    """Returns the set of slot names used in a template."""
+    return {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+
+
+class PhrasingPool:
+    """
+    Pool of rephrasings per terminal template. Slots are filled locally, variants are
+    picked at random, and model-generated variants expire and are rebuilt in the background.
+    """
+
+    def __init__(self, rephrase, templates=TERMINAL_TEMPLATES, pool_size=PHRASING_POOL_SIZE, ttl=PHRASING_TTL, **default_slots):
+        self.rephrase = rephrase  # Callable turning a template into a new phrasing, raising on failure
+        self.templates = templates
+        self.pool_size = pool_size
+        self.ttl = ttl
+        self.default_slots = default_slots
+        self._generated = {key: [] for key in templates}  # key -> list of (expires_at, variant)
+        self._refreshing = set()
+        self._retry_at = {key: 0 for key in templates}
+        self._lock = threading.Lock()
+
+    def render(self, key, **slots):
+        """Fills a random phrasing of the template with the given slots."""
+        now = time.time()
+        with self._lock:
+            generated = [variant for expires_at, variant in self._generated[key] if expires_at > now]
+            stale = len(generated) < len(self._generated[key]) or not generated
+            if stale and now >= self._retry_at[key]:
+                self._schedule_refresh(key)
+        variant = random.choice(self.templates[key] + generated)
+        return variant.format(**{**self.default_slots, **slots})
+
+    def warm_up(self):
+        """Builds the generated variants of every template in the background."""
+        with self._lock:
+            for key in self.templates:
+                self._schedule_refresh(key)
+
+    def _schedule_refresh(self, key):
+        # Called with the lock held
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        threading.Thread(target=self._refresh, args=(key,), name=f"phrasing-{key}", daemon=True).start()
+
+    def _refresh(self, key):
+        template = self.templates[key][0]
+        fields = template_fields(template)
+        variants = []
+        try:
+            for _ in range(self.pool_size):
+                try:
+                    variant = self.rephrase(template).strip()
+                    # A usable variant keeps exactly the template's slots and nothing else in braces
+                    if variant and template_fields(variant) == fields:
+                        variants.append(variant)
+                    else:
+                        logging.warning(f"Discarding rephrasing of {key} with mismatched slots: {variant}")
+                except (ValueError, IndexError) as e:
+                    logging.warning(f"Discarding malformed rephrasing of {key}: {e}")
+        except Exception as e:
+            logging.error(f"Error rephrasing {key} template: {e}")
+        finally:
+            now = time.time()
+            with self._lock:
+                if variants:
+                    self._generated[key] = [(now + self.ttl, variant) for variant in variants]
+                else:
+                    self._retry_at[key] = now + PHRASING_RETRY_DELAY
+                self._refreshing.discard(key)
+        logging.info(f"Phrasing pool for {key} refreshed with {len(variants)} generated variants")
@@ -0,0 +1,119 @@
+"""
+Concession policy for the negotiator. Each turn it decides locally whether to accept the
+user's offer, hold the current price or concede to a new one, so the model only has to put
+a price that is already decided into words.
+
+The next offer follows a concession curve from the list price down to the floor over the
+allowed attempts, and concedes faster when the user raises their offer.
+"""
+import os
+import math
+from collections import namedtuple
+
+POLICY_CURVE = os.getenv("POLICY_CURVE", "boulware")  # How concessions are spread over the attempts, see CURVES
+POLICY_RECIPROCITY = float(os.getenv("POLICY_RECIPROCITY", 0.5))  # Share of the user's raise matched by our next offer
+POLICY_PRICE_STEP = float(os.getenv("POLICY_PRICE_STEP", 5))  # Offers are rounded up to a multiple of this
+ACCEPT_MARGIN = 0.02  # Offers up to 2% below our next concession price are accepted
+LOWBALL_RATIO = 0.5  # Offers below half the list price aren't worth a counteroffer
+
+# Share of the list-to-floor range conceded once `progress` of the attempts have been used
+CURVES = {
+    'linear': lambda progress: progress,
+    'boulware': lambda progress: progress ** 2,  # Holds out and concedes late
+    'conceder': lambda progress: math.sqrt(progress)  # Concedes early
+}
+
+# action is 'accept', 'counter', 'hold' or 'lowball'; price is the price to close at or to offer
+Decision = namedtuple('Decision', ['action', 'price', 'reason'])
+
+
+def format_price(price):
+    """Formats a price without trailing zeros, e.g. 1440 or 1397.5."""
+    return f"{price:.2f}".rstrip('0').rstrip('.')
+
+
+class ConcessionPolicy:
+    def __init__(self, list_price, floor, max_attempts, curve=POLICY_CURVE, reciprocity=POLICY_RECIPROCITY, step=POLICY_PRICE_STEP):
+        if curve not in CURVES:
+            raise ValueError(f"Unknown concession curve: {curve}")
+        self.list_price = list_price
+        self.floor = floor
+        self.max_attempts = max_attempts
+        self.curve = CURVES[curve]
+        self.reciprocity = reciprocity
+        self.step = step
+
+    def target(self, attempt):
+        """Returns the curve's price for an attempt, from the list price at 0 to the floor at max_attempts."""
+        progress = min(max(attempt / self.max_attempts, 0.0), 1.0)
+        return self.list_price - (self.list_price - self.floor) * self.curve(progress)
+
+    def _round(self, price):
+        # Rounding up keeps offers at or above the floor
+        return max(self.floor, math.ceil(price / self.step - 1e-9) * self.step)
+
+    def decide(self, current_price, attempts, user_offer, previous_offers=()):
+        """
+        Decides the negotiator's next move.
+        current_price is our last offer, attempts the counteroffers made so far, user_offer the
+        price in the user's latest message (or None) and previous_offers the user's earlier prices.
+        """
+        if user_offer is not None and user_offer < LOWBALL_RATIO * self.list_price:
+            return Decision('lowball', current_price, f"offer below {LOWBALL_RATIO:.0%} of the list price")
+        if user_offer is not None and user_offer >= current_price:
+            return Decision('accept', current_price, "offer meets our price")
+
+        next_price = min(current_price, self.target(attempts + 1))
+        last_offer = previous_offers[-1] if previous_offers else None
+        if user_offer is not None and last_offer is not None and user_offer > last_offer:
+            next_price = min(next_price, current_price - self.reciprocity * (user_offer - last_offer))
+        next_price = min(current_price, self._round(next_price))
+
+        if user_offer is None:
+            return Decision('counter', next_price, "no offer made")
+        if user_offer >= self.floor and user_offer >= (1 - ACCEPT_MARGIN) * next_price:
+            return Decision('accept', user_offer, "offer meets our next price")
+        if last_offer is not None and user_offer <= last_offer:
+            return Decision('hold', current_price, "offer not improved")
+        return Decision('counter', next_price, "concession")
+
+
+def acceptance_violations(policy, step=5):
+    """
+    Checks that a higher offer is never refused where a lower one is accepted, over every
+    current price from the floor to the list price, every attempt and a few offer histories.
+    Returns (current_price, attempts, previous_offers, accepted_offer, refused_offer) per violation.
+    """
+    violations = []
+    offers = range(int(LOWBALL_RATIO * policy.list_price), int(policy.list_price) + 2 * step, step)
+    for current_price in range(int(policy.floor), int(policy.list_price) + 1, step):
+        for attempts in range(policy.max_attempts):
+            for previous_offers in ((), (policy.floor - 100,), (policy.floor - 100, current_price - 2 * step)):
+                accepted = None
+                for offer in offers:
+                    action = policy.decide(current_price, attempts, offer, previous_offers).action
+                    if action == 'accept' and accepted is None:
+                        accepted = offer
+                    elif action != 'accept' and accepted is not None:
+                        violations.append((current_price, attempts, previous_offers, accepted, offer))
+                        break
+    return violations
+
+
+def decision_prompt(decision, currency):
+    """
+    Tells the negotiation model what to say this turn. Accepted offers close the negotiation
+    without the model, so they have no prompt.
+    """
+    price = f"{format_price(decision.price)} {currency}"
+    if decision.action == 'lowball':
+        return (
+            "The user's offer is less than half of the list price. Tell them that we won't have a deal with "
+            f"this kind of offer so please try to do better. Your price stays at {price}; offer exactly {price}."
+        )
+    if decision.action == 'hold':
+        return (
+            "The user has not improved their offer. Politely ask them for a better offer. "
+            f"Your price stays at {price}; offer exactly {price}."
+        )
+    return f"Offer exactly {price} this time. Do not offer, suggest or agree to any other price."
@@ -0,0 +1,203 @@
+import os
+import re
+from collections import namedtuple
+
+# Result of a local extraction. `confidence` is how sure we are that `price`
+# (None when the message carries no price) is what the speaker offered.
+PriceExtraction = namedtuple('PriceExtraction', ['price', 'confidence', 'reason'])
+
+# Local extractions at or above this confidence are used as-is; anything less goes to the model
+LOCAL_PRICE_CONFIDENCE = float(os.getenv("LOCAL_PRICE_CONFIDENCE", 0.8))
+
+# Numbers below this are treated as quantities ("4 wheels", "5 times") unless they carry a currency marker
+MIN_PLAUSIBLE_PRICE = 20
+
+CURRENCY_PREFIX = r'(?P<prefix>£|\$|€|\bgbp\s*)'
+NUMBER_PATTERN = re.compile(
+    CURRENCY_PREFIX + r'?\s*'
+    r'(?<![\w.,])(?P<number>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)'
+    r'(?P<suffix>\s*(?:k|grand|thousand|hundred)\b)?'
+    r'(?P<unit>\s*(?:gbp|pounds?|quid|£)(?![a-z]))?',
+    re.IGNORECASE
+)
+WORD_PATTERN = re.compile(r"[a-z]+", re.IGNORECASE)
+RANGE_JOINERS = {'-', '–', 'to', 'or'}
+QUANTITY_WORDS = {'wheel', 'wheels', 'time', 'times', 'attempt', 'attempts', 'year', 'years', 'day', 'days', 'tyre', 'tyres', 'percent'}
+
+UNITS = {
+    'zero': 0, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8,
+    'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'thirteen': 13, 'fourteen': 14, 'fifteen': 15,
+    'sixteen': 16, 'seventeen': 17, 'eighteen': 18, 'nineteen': 19
+}
+TENS = {
+    'twenty': 20, 'thirty': 30, 'forty': 40, 'fifty': 50, 'sixty': 60, 'seventy': 70, 'eighty': 80, 'ninety': 90
+}
+SCALES = {'hundred': 100, 'thousand': 1000, 'grand': 1000}
+CURRENCY_WORDS = {'pounds', 'pound', 'quid', 'gbp'}
+# A price the speaker objects to ("fifteen hundred is too much") is a quote rather than an offer
+OBJECTION_PATTERN = re.compile(r"\btoo (?:much|high|expensive|steep|pricey)\b", re.IGNORECASE)
+
+
+class _Candidate:
+    __slots__ = ('value', 'marked', 'start', 'end')
+
+    def __init__(self, value, marked, start, end):
+        self.value = value
+        self.marked = marked  # Carries a currency symbol or unit
+        self.start = start
+        self.end = end
+
+
+def _numeric_candidates(text):
+    candidates = []
+    for match in NUMBER_PATTERN.finditer(text):
+        end = match.end()
+        following = text[end:end + 2].lstrip()
+        if text[end:end + 1].isalnum() or following.startswith('%'):
+            continue  # Part of a code like "X7K2P9" or a percentage
+        value = float(match.group('number').replace(',', ''))
+        if match.group('suffix'):
+            value *= 100 if match.group('suffix').strip().lower() == 'hundred' else 1000  # "12 hundred", "1.2k"
+        marked = bool(match.group('prefix') or match.group('unit'))
+        next_word = WORD_PATTERN.match(text[end:].lstrip())
+        if not marked and next_word and next_word.group(0).lower() in QUANTITY_WORDS:
+            continue
+        start = match.start('prefix') if match.group('prefix') else match.start('number')
+        candidates.append(_Candidate(value, marked, start, end))
+    return candidates
+
+
+def words_to_number(words):
+    """
+    Converts a run of number words ("thirteen hundred", "twelve fifty", "one thousand two hundred and fifty") to a value.
+    """
+    total = 0
+    current = 0
+    previous = None  # Kind of the last word: 'unit', 'teen', 'tens' or 'scale'
+    for word in words:
+        if word in ('and', 'a'):
+            if word == 'a':
+                current = current or 1
+            continue
+        if word in UNITS or word in TENS:
+            value = UNITS.get(word, TENS.get(word))
+            kind = 'tens' if word in TENS else ('teen' if value >= 10 else 'unit')
+            if previous in ('teen', 'tens') and (kind != 'unit' or previous == 'teen'):
+                # Colloquial prices such as "twelve fifty" (1250) or "thirteen five" (1305)
+                current = current * 100 + value
+            else:
+                current += value
+            previous = kind
+        elif word in SCALES:
+            scale = SCALES[word]
+            current = (current or 1) * scale
+            if scale >= 1000:
+                total += current
+                current = 0
+            previous = 'scale'
+    return total + current
+
+
+def _word_candidates(text):
+    candidates = []
+    run = []
+    run_start = run_end = None
+    previous_word = None
+    in_range = False  # The run follows "between", so an "and" separates its two ends
+    for match in WORD_PATTERN.finditer(text):
+        word = match.group(0).lower()
+        is_number_word = word in UNITS or word in TENS or word in SCALES
+        joins_run = word == 'and' and run and not in_range or word == 'a'
+        contiguous = run_end is None or not text[run_end:match.start()].strip(' -')
+        if (is_number_word or joins_run) and (not run or contiguous):
+            if not run:
+                run_start = match.start()
+                in_range = previous_word == 'between'
+            run.append(word)
+            run_end = match.end()
+            previous_word = word
+            continue
+        if run:
+            candidates.append(_close_word_run(text, run, run_start, run_end, word))
+        run = []
+        run_end = None
+        if is_number_word:
+            run, run_start, run_end = [word], match.start(), match.end()
+            in_range = previous_word == 'between'
+        previous_word = word
+    if run:
+        candidates.append(_close_word_run(text, run, run_start, run_end, None))
+    return [c for c in candidates if c is not None]
+
+
+def _close_word_run(text, run, start, end, next_word):
+    while run and run[-1] in ('and', 'a'):
+        run.pop()
+    if not any(word not in ('and', 'a') for word in run):
+        return None
+    value = words_to_number(run)
+    if next_word in QUANTITY_WORDS:
+        return None
+    return _Candidate(float(value), next_word in CURRENCY_WORDS, start, end)
+
+
+def _merge_ranges(text, candidates):
+    """Collapses "1200-1300", "1200 to 1300" and "between 1200 and 1300" into their low end."""
+    merged = []
+    ranges = 0
+    i = 0
+    while i < len(candidates):
+        current = candidates[i]
+        if i + 1 < len(candidates):
+            following = candidates[i + 1]
+            joiner = text[current.end:following.start].strip().lower()
+            between = text[max(0, current.start - 8):current.start].lower().rstrip().endswith('between')
+            if joiner in RANGE_JOINERS or (joiner == 'and' and between):
+                low = min(current.value, following.value)
+                merged.append(_Candidate(low, current.marked or following.marked, current.start, following.end))
+                ranges += 1
+                i += 2
+                continue
+        merged.append(current)
+        i += 1
+    return merged, ranges
+
+
+def _price_candidates(message):
+    numeric = _numeric_candidates(message)
+    # Words such as "grand" in "1.2 grand" already belong to a numeric candidate
+    words = [w for w in _word_candidates(message) if not any(n.start <= w.start < n.end for n in numeric)]
+    candidates = sorted(numeric + words, key=lambda c: c.start)
+    return [c for c in candidates if c.marked or c.value >= MIN_PLAUSIBLE_PRICE]
+
+
+def prices_in_message(message):
+    """Returns every price a message mentions, in order, including both ends of ranges."""
+    return [c.value for c in _price_candidates(message)]
+
+
+def extract_price_locally(message):
+    """
+    Extracts the offered price from a negotiation message without calling the model.
+    Returns a PriceExtraction whose confidence is low when the message is ambiguous.
+    """
+    candidates, ranges = _merge_ranges(message, _price_candidates(message))
+
+    if not candidates:
+        if any(ch.isdigit() for ch in message):
+            return PriceExtraction(None, 0.85, 'only non-price numbers')
+        return PriceExtraction(None, 0.95, 'no numbers')
+
+    if OBJECTION_PATTERN.search(message):
+        return PriceExtraction(candidates[-1].value, 0.5, 'price objected to')
+    values = {c.value for c in candidates}
+    marked_values = {c.value for c in candidates if c.marked}
+    if len(values) == 1:
+        confidence = 0.98 if marked_values else 0.85
+        if ranges:
+            return PriceExtraction(candidates[-1].value, round(confidence - 0.05, 2), 'range')
+        return PriceExtraction(candidates[-1].value, confidence, 'single price')
+    if len(marked_values) == 1:
+        return PriceExtraction(marked_values.pop(), 0.9, 'single marked price')
+    # Several different prices: the latest one is the usual answer, but leave it to the model
+    return PriceExtraction(candidates[-1].value, 0.5, 'multiple prices')
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+# Session settings
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "memory", "sqlite" or "redis"
+SESSION_TTL = int(os.getenv("SESSION_TTL", 1800))  # Seconds a negotiation may sit idle before it is evicted
+SESSION_MAX = int(os.getenv("SESSION_MAX", 10000))  # Upper bound on live sessions per store
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.db"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+def new_session_id():
+    """Generates a new opaque session id."""
+    return uuid.uuid4().hex
+
+
+class InMemorySessionStore:
+    """
+    Keeps negotiation state in this process, bounded by an LRU limit and an idle TTL.
+    Only suitable when a single worker process serves all requests.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, ttl=SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # session_id -> (expires_at, serialized state)
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at <= now:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+        # Hand out a copy so callers never mutate the stored state in place
+        return json.loads(payload)
+
+    def save(self, session_id, state):
+        payload = json.dumps(state)
+        with self._lock:
+            self._sessions[session_id] = (time.time() + self.ttl, payload)
+            self._sessions.move_to_end(session_id)
+            self._evict()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict(self):
+        now = time.time()
+        # Entries are ordered by last use, so expired ones collect at the front
+        while self._sessions:
+            oldest_id, (expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at > now and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[oldest_id]
+            logging.info(f"Evicted session {oldest_id}")
+
+
+class SQLiteSessionStore:
+    """
+    Keeps negotiation state in a SQLite database so several worker processes
+    on the same host can serve the same sessions.
+    """
+
+    PURGE_EVERY = 100  # Run the expiry sweep once every this many saves
+
+    def __init__(self, path=SESSION_DB_PATH, max_sessions=SESSION_MAX, ttl=SESSION_TTL):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._local = threading.local()
+        self._saves = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        row = self._connect().execute(
+            "SELECT state FROM sessions WHERE session_id = ? AND expires_at > ?",
+            (session_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id, state):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, expires_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(state), time.time() + self.ttl)
+            )
+        self._saves += 1
+        if self._saves % self.PURGE_EVERY == 0:
+            self.purge()
+
+    def delete(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge(self):
+        """Drops expired sessions and trims the least recently saved ones beyond max_sessions."""
+        with self._connect() as conn:
+            expired = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+            trimmed = conn.execute(
+                "DELETE FROM sessions WHERE session_id IN ("
+                "SELECT session_id FROM sessions ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,)
+            ).rowcount
+        if expired or trimmed:
+            logging.info(f"Purged {expired} expired and {trimmed} excess sessions")
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class RedisSessionStore:
+    """
+    Keeps negotiation state in Redis (or any server speaking its protocol),
+    relying on key expiry for eviction.
+    """
+
+    def __init__(self, url=REDIS_URL, ttl=SESSION_TTL, prefix="negotiator:session:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("SESSION_BACKEND=redis requires the 'redis' package") from e
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, session_id):
+        payload = self.client.get(self.prefix + session_id)
+        return json.loads(payload) if payload else None
+
+    def save(self, session_id, state):
+        self.client.setex(self.prefix + session_id, self.ttl, json.dumps(state))
+
+    def delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    """Builds the session store selected by SESSION_BACKEND."""
+    if backend == "memory":
+        return InMemorySessionStore()
+    elif backend == "sqlite":
+        return SQLiteSessionStore()
+    elif backend == "redis":
+        return RedisSessionStore()
+    raise ValueError(f"Unknown session backend: {backend}")
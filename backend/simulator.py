@@ -0,0 +1,275 @@
+"""
+Offline negotiation simulator. Runs scripted buyer personas through the negotiation flow
+against the in-process model stand-in, spread over a process pool, and aggregates final
+prices, turns to close, floor violations and upstream calls per negotiation.
+
+    python simulator.py --negotiations 5000 --processes 8 --output sim_results.json
+    python simulator.py --pricing model --max-attempts 6
+    python simulator.py --curve conceder --accept-margin 0.05
+
+Buyers open with utterances from polite_negotiator_data.jsonl. Each negotiation is
+seeded, so runs with the same options are comparable.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import multiprocessing
+from collections import Counter, defaultdict
+
+from bench_load import percentile
+from mock_openai import MockState, in_process_client, parse_latency
+
+SEED_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'polite_negotiator_data.jsonl')
+OFFER_TEMPLATES = ("How about £{:,}?", "I can do {} GBP.", "Would you take {}?", "My best is £{:,}", "{} pounds and we have a deal?")
+
+# Offers as shares of the list price, raise per turn, walk-away price as a share of the list
+# price, chance of taking an acceptable price, turns before giving up, and chances of chatting
+# without an offer or repeating the last offer.
+PERSONAS = {
+    'haggler': {'open': (0.70, 0.80), 'step': (20, 50), 'limit': (0.83, 0.93), 'accept': 0.4, 'patience': (8, 12), 'chatter': 0.1, 'repeat': 0.05},
+    'lowballer': {'open': (0.35, 0.55), 'step': (40, 90), 'limit': (0.80, 0.87), 'accept': 0.5, 'patience': (6, 10), 'chatter': 0.05, 'repeat': 0.05},
+    'quick_closer': {'open': (0.85, 0.93), 'step': (20, 40), 'limit': (0.93, 0.99), 'accept': 0.9, 'patience': (4, 6), 'chatter': 0.0, 'repeat': 0.0},
+    'stubborn': {'open': (0.65, 0.75), 'step': (10, 20), 'limit': (0.76, 0.84), 'accept': 0.6, 'patience': (6, 9), 'chatter': 0.05, 'repeat': 0.3},
+    'chatty': {'open': (0.75, 0.85), 'step': (20, 40), 'limit': (0.85, 0.95), 'accept': 0.5, 'patience': (8, 12), 'chatter': 0.4, 'repeat': 0.0}
+}
+
+# Set in each worker process by init_worker
+negotiator = None
+stand_in = None
+seed_utterances = []
+
+
+def load_seed_utterances(path=SEED_DATA):
+    """Returns the user messages of the fine-tuning data, used as openers and small talk."""
+    utterances = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                utterances.extend(m['content'] for m in json.loads(line)['messages'] if m['role'] == 'user')
+    return utterances
+
+
+class Buyer:
+    """A scripted buyer drawn from a persona, raising their offer until the price is right or patience runs out."""
+
+    def __init__(self, persona, rng, list_price, utterances):
+        params = PERSONAS[persona]
+        self.persona = persona
+        self.rng = rng
+        self.utterances = utterances
+        self.offer = round(list_price * rng.uniform(*params['open']), -1)
+        self.step = rng.randrange(params['step'][0], params['step'][1] + 1, 5)
+        self.limit = round(list_price * rng.uniform(*params['limit']), -1)
+        self.accept = params['accept']
+        self.patience = rng.randint(*params['patience'])
+        self.chatter = params['chatter']
+        self.repeat = params['repeat']
+        self.last_offer = None
+        self.turns = 0
+
+    def opener(self):
+        return self.rng.choice(self.utterances) if self.utterances else "Hi!"
+
+    def next_message(self, last_price, show_buttons):
+        self.turns += 1
+        acceptable = last_price is not None and last_price <= self.limit
+        if show_buttons:
+            return "Deal!" if acceptable else "No Deal!"
+        if acceptable and self.rng.random() < self.accept:
+            return "Deal!"
+        if self.turns > self.patience:
+            return "No Deal!"
+        if self.utterances and self.rng.random() < self.chatter:
+            return self.rng.choice(self.utterances)
+        if self.last_offer is not None and self.rng.random() < self.repeat:
+            offer = self.last_offer
+        else:
+            offer = int(min(self.offer, self.limit))
+            self.offer += self.step
+        self.last_offer = offer
+        return self.rng.choice(OFFER_TEMPLATES).format(offer)
+
+
+def init_worker(config):
+    """Imports the backend in the worker and points it at a fresh in-process stand-in."""
+    global negotiator, stand_in, seed_utterances
+    # Hand-written phrasings only, so background rephrasing doesn't count against the call budget
+    os.environ['PHRASING_POOL_SIZE'] = '0'
+    import app as negotiator
+    import policy
+    logging.getLogger().setLevel(logging.WARNING)
+
+    stand_in = MockState(parse_latency(config['latency']), config['error_rate'], script=config['script'])
+    negotiator.client = in_process_client(stand_in)
+    negotiator.PRICING_MODE = config['pricing']
+    negotiator.MAX_ATTEMPTS = config['max_attempts']
+    policy.ACCEPT_MARGIN = config['accept_margin']
+    negotiator.OFFER_ACCEPT_MARGIN = config['accept_margin']
+    negotiator.pricing_policy = policy.ConcessionPolicy(
+        negotiator.ACTUAL_PRICE, negotiator.MIN_PRICE, config['max_attempts'], curve=config['curve']
+    )
+    seed_utterances = load_seed_utterances(config['seed_data'])
+
+
+def check_policy():
+    """A buyer raising their offer must never go from accepted to refused; returns the cases where they do."""
+    import policy
+    return policy.acceptance_violations(negotiator.pricing_policy)
+
+
+def run_negotiation(seed):
+    """Runs one seeded negotiation and returns its record."""
+    random.seed(seed)  # The backend and stand-in draw discounts, codes and counteroffers from here
+    rng = random.Random(seed)
+    persona = rng.choice(sorted(PERSONAS))
+    buyer = Buyer(persona, rng, negotiator.ACTUAL_PRICE, seed_utterances)
+    calls_before = stand_in.stats()['calls']
+
+    state = negotiator.new_negotiation_state()
+    response = negotiator.initialize_openai_response(state, buyer.opener())
+    bot_prices = [response['last_negotiated_price']]
+    turns = 1
+    errors = 0
+    # Error replies leave the negotiation open, so cap the turns in case the stand-in keeps failing
+    while not state['negotiation_closed'] and turns < 3 * negotiator.MAX_ATTEMPTS:
+        message = buyer.next_message(bot_prices[-1], response['show_buttons'])
+        response = negotiator.get_openai_response(state, message)
+        turns += 1
+        if response['response'] == negotiator.error_response(state)['response']:
+            errors += 1
+        elif response['last_negotiated_price'] is not None:  # Deals reset it to None
+            bot_prices.append(response['last_negotiated_price'])
+
+    if state['deal_price'] is not None:
+        outcome, final_price = 'deal', state['deal_price']
+    elif state['negotiation_closed'] and response['show_buttons']:
+        outcome, final_price = 'max_attempts', response['last_negotiated_price']
+    elif state['negotiation_closed']:
+        outcome, final_price = 'rejected', None
+    else:
+        outcome, final_price = 'unfinished', None
+
+    calls_after = stand_in.stats()['calls']
+    calls = {purpose: calls_after[purpose] - calls_before[purpose] for purpose in calls_after}
+    floor = negotiator.MIN_PRICE
+    violations = sum(1 for price in bot_prices if price is not None and price < floor)
+    if outcome == 'deal' and final_price < floor:
+        violations += 1
+    return {
+        'seed': seed,
+        'persona': persona,
+        'outcome': outcome,
+        'final_price': final_price,
+        'turns': turns,
+        'floor_violations': violations,
+        'errors': errors,
+        'calls': sum(calls.values()),
+        'calls_by_purpose': calls
+    }
+
+
+def summarize(records, elapsed):
+    def stats(values):
+        if not values:
+            return None
+        return {
+            'mean': round(sum(values) / len(values), 2),
+            'p10': percentile(values, 0.1),
+            'p50': percentile(values, 0.5),
+            'p90': percentile(values, 0.9)
+        }
+
+    deals = [r for r in records if r['outcome'] == 'deal']
+    calls_by_purpose = Counter()
+    by_persona = defaultdict(list)
+    for record in records:
+        calls_by_purpose.update(record['calls_by_purpose'])
+        by_persona[record['persona']].append(record)
+    return {
+        'negotiations': len(records),
+        'elapsed_s': round(elapsed, 2),
+        'runs_per_s': round(len(records) / elapsed, 1) if elapsed else None,
+        'outcomes': dict(Counter(r['outcome'] for r in records)),
+        'deal_rate': round(len(deals) / len(records), 4) if records else None,
+        'final_price': stats([r['final_price'] for r in deals]),
+        'turns_to_close': stats([r['turns'] for r in deals]),
+        'floor_violations': sum(r['floor_violations'] for r in records),
+        'negotiations_with_floor_violations': sum(1 for r in records if r['floor_violations']),
+        'errors': sum(r['errors'] for r in records),
+        'calls_per_negotiation': stats([r['calls'] for r in records]),
+        'calls_by_purpose': {purpose: count for purpose, count in sorted(calls_by_purpose.items()) if count},
+        'by_persona': {
+            persona: {
+                'negotiations': len(group),
+                'deal_rate': round(sum(r['outcome'] == 'deal' for r in group) / len(group), 4),
+                'mean_final_price': (stats([r['final_price'] for r in group if r['outcome'] == 'deal']) or {}).get('mean'),
+                'mean_turns': round(sum(r['turns'] for r in group) / len(group), 2)
+            }
+            for persona, group in sorted(by_persona.items())
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--negotiations', type=int, default=2000)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pricing', choices=('policy', 'model'), default=os.getenv("PRICING_MODE", "policy"))
+    parser.add_argument('--curve', default=os.getenv("POLICY_CURVE", "boulware"), help="concession curve for policy pricing")
+    parser.add_argument('--max-attempts', type=int, default=10)
+    parser.add_argument('--accept-margin', type=float, default=0.02, help="share of our price an offer may be off by and still be accepted")
+    parser.add_argument('--latency', default='fixed:0', help="stand-in latency, as for mock_openai.py")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--script', help="JSON file of scripted stand-in replies, as for mock_openai.py")
+    parser.add_argument('--seed-data', default=SEED_DATA, help="JSONL of example conversations to take buyer utterances from")
+    parser.add_argument('--records', help="also write one JSON line per negotiation here")
+    parser.add_argument('--output', help="write the results JSON here as well as to stdout")
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, encoding='utf-8') as f:
+            script = json.load(f)
+    config = {
+        'pricing': args.pricing,
+        'curve': args.curve,
+        'max_attempts': args.max_attempts,
+        'accept_margin': args.accept_margin,
+        'latency': args.latency,
+        'error_rate': args.error_rate,
+        'script': script,
+        'seed_data': args.seed_data
+    }
+
+    seeds = range(args.seed, args.seed + args.negotiations)
+    with multiprocessing.Pool(args.processes, initializer=init_worker, initargs=(config,)) as pool:
+        violations = pool.apply(check_policy) if args.pricing == 'policy' else []
+        if violations:
+            for violation in violations[:5]:
+                print(f"Policy accepts a lower offer than it refuses (current price, attempts, previous offers, accepted, refused): {violation}", file=sys.stderr)
+            return 1
+        start = time.perf_counter()
+        records = list(pool.imap_unordered(run_negotiation, seeds, chunksize=max(1, args.negotiations // (8 * args.processes))))
+    elapsed = time.perf_counter() - start
+    records.sort(key=lambda record: record['seed'])
+
+    results = {'config': {**config, 'script': args.script, 'processes': args.processes, 'seed': args.seed}, **summarize(records, elapsed)}
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    if args.records:
+        with open(args.records, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
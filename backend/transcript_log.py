@@ -0,0 +1,132 @@
+"""
+Append-only transcript of negotiation turns, for analytics and retraining.
+
+Each turn gets an event dict. Code running during the turn adds fields to it with note(),
+and the route queues it once the response is ready. A background thread writes queued
+events in batches to JSONL segments that rotate by size. When the queue is full, events
+are dropped rather than blocking the request, and the drop is counted in the metrics.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+
+import metrics
+
+TRANSCRIPT_LOG = os.getenv("TRANSCRIPT_LOG", "1") == "1"  # Set to 0 to keep no transcripts
+TRANSCRIPT_DIR = os.getenv("TRANSCRIPT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "transcripts"))
+TRANSCRIPT_SEGMENT_BYTES = int(os.getenv("TRANSCRIPT_SEGMENT_BYTES", 64 * 1024 * 1024))  # Size at which a new segment is started
+TRANSCRIPT_QUEUE_SIZE = int(os.getenv("TRANSCRIPT_QUEUE_SIZE", 10000))  # Events waiting to be written before new ones are dropped
+TRANSCRIPT_BATCH_SIZE = 500  # Most events written per flush
+TRANSCRIPT_FLUSH_INTERVAL = float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL", 1.0))  # Longest an event waits for its batch to fill
+
+_current_event = contextvars.ContextVar('transcript_event', default=None)
+_STOP = object()
+
+
+def begin_turn(endpoint):
+    """Starts the transcript event of a turn in the current context."""
+    event = {'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'), 'endpoint': endpoint}
+    _current_event.set(event)
+    return event
+
+
+def note(**fields):
+    """Adds fields to the current turn's event. Does nothing outside a turn."""
+    event = _current_event.get()
+    if event is not None:
+        event.update(fields)
+
+
+class TranscriptLog:
+    """Background writer of transcript events to rotating JSONL segments."""
+
+    def __init__(self, directory=TRANSCRIPT_DIR, segment_bytes=TRANSCRIPT_SEGMENT_BYTES, queue_size=TRANSCRIPT_QUEUE_SIZE,
+                 batch_size=TRANSCRIPT_BATCH_SIZE, flush_interval=TRANSCRIPT_FLUSH_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._segment_size = 0
+        self._segments = 0
+        self._thread = threading.Thread(target=self._run, name='transcript-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, event):
+        """Queues an event for writing without waiting on the disk."""
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            metrics.TRANSCRIPT_EVENTS.inc(result='dropped')
+
+    def close(self, timeout=5.0):
+        """Writes out the queued events and stops the writer."""
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logging.warning("Transcript queue is still full, closing without writing the remaining events")
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP:
+                batch.pop()
+                stopping = True
+            if batch:
+                self._write(batch)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, batch):
+        data = ''.join(json.dumps(event, default=str) + '\n' for event in batch).encode('utf-8')
+        try:
+            if self._file is None or self._segment_size >= self.segment_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            self._segment_size += len(data)
+            metrics.TRANSCRIPT_EVENTS.inc(len(batch), result='written')
+        except OSError as e:
+            logging.error(f"Error writing {len(batch)} transcript events: {e}")
+            metrics.TRANSCRIPT_EVENTS.inc(len(batch), result='failed')
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.makedirs(self.directory, exist_ok=True)
+        # The process id keeps segments apart when several workers share the directory
+        name = f"transcript-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._segments:04d}.jsonl"
+        self._file = open(os.path.join(self.directory, name), 'ab')
+        self._segment_size = 0
+        self._segments += 1
+
+
+def create_transcript_log():
+    """Returns the TranscriptLog configured by the environment, or None when transcripts are off."""
+    if not TRANSCRIPT_LOG:
+        return None
+    return TranscriptLog()
@@ -0,0 +1,239 @@
+"""
+Resilience layer for the model calls. Every call made through UpstreamCaller gets:
+
+- a per-attempt timeout, capped by what is left of the turn's overall deadline
+- retries of transient errors (connection problems, timeouts, 408/409/429/5xx) after a
+  jittered exponential backoff, while the deadline allows
+- optionally, for the purposes in HEDGE_PURPOSES, a duplicate request sent once the first
+  has been outstanding for HEDGE_AFTER seconds, the first good reply winning
+- a circuit breaker that fails calls immediately after repeated transient failures, so
+  callers go straight to their local fallbacks until the upstream recovers
+
+Streamed calls are retried and hedged up to their first chunk. After that, tokens may
+already have reached the user.
+"""
+import os
+import time
+import random
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import metrics
+
+try:
+    import openai
+    _CONNECTION_ERRORS = (openai.APIConnectionError,)  # Includes openai.APITimeoutError
+except ImportError:
+    _CONNECTION_ERRORS = ()
+
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 15))  # Seconds one attempt may take
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", 2))  # Extra attempts after a transient error
+UPSTREAM_BACKOFF = float(os.getenv("UPSTREAM_BACKOFF", 0.25))  # Base of the exponential backoff, in seconds
+TURN_DEADLINE = float(os.getenv("TURN_DEADLINE", 30))  # Seconds all the model calls of one turn may take
+HEDGE_AFTER = float(os.getenv("HEDGE_AFTER", 0))  # Seconds before a hedged call sends a duplicate, 0 disables hedging
+HEDGE_PURPOSES = ('negotiation',)  # Latency-critical calls worth hedging
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", 5))  # Consecutive failures that open the circuit
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", 30))  # Seconds the circuit stays open before a trial call
+TRANSIENT_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+_deadline = contextvars.ContextVar('upstream_deadline', default=None)
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class DeadlineExceeded(UpstreamError):
+    pass
+
+
+class AttemptTimeout(UpstreamError, TimeoutError):
+    pass
+
+
+def begin_turn(seconds=TURN_DEADLINE):
+    """Starts the deadline for the model calls of a turn in the current context."""
+    _deadline.set(time.monotonic() + seconds)
+
+
+def remaining():
+    """Seconds left before the current turn's deadline, or None outside a turn."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def is_transient(error):
+    """Whether an error is worth retrying and counts against the upstream's health."""
+    if isinstance(error, (AttemptTimeout, TimeoutError) + _CONNECTION_ERRORS):
+        return True
+    return getattr(error, 'status_code', None) in TRANSIENT_STATUS_CODES
+
+
+class CircuitBreaker:
+    """Closed until `threshold` consecutive failures, then open for `reset_timeout` seconds, then one trial call."""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._transition('half_open')
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_running = False
+            if self.state != 'closed':
+                self._transition('closed')
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self.state == 'half_open' or (self.state == 'closed' and self._failures >= self.threshold):
+                self._opened_at = time.monotonic()
+                self._transition('open')
+
+    def _transition(self, state):
+        # Called with the lock held
+        logging.warning(f"Upstream circuit breaker {self.state} -> {state}")
+        self.state = state
+        metrics.CIRCUIT_TRANSITIONS.inc(state=state)
+
+
+class PeekedStream:
+    """A stream whose first chunk has already been read, so it can be retried or hedged up to that point."""
+
+    def __init__(self, stream, chunks, first):
+        self.stream = stream
+        self._chunks = chunks
+        self._first = first
+
+    def __iter__(self):
+        if self._first is not None:
+            yield self._first
+        yield from self._chunks
+
+    def close(self):
+        close = getattr(self.stream, 'close', None)
+        if close is not None:
+            close()
+
+
+def _close_result(future):
+    # The losing side of a hedge may still hold an open stream
+    if not future.cancelled() and future.exception() is None:
+        close = getattr(future.result(), 'close', None)
+        if close is not None:
+            close()
+
+
+class UpstreamCaller:
+    def __init__(self, timeout=UPSTREAM_TIMEOUT, retries=UPSTREAM_RETRIES, backoff=UPSTREAM_BACKOFF,
+                 hedge_after=HEDGE_AFTER, hedge_purposes=HEDGE_PURPOSES, breaker=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self.hedge_purposes = hedge_purposes
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="hedge")
+
+    def call(self, purpose, create, **kwargs):
+        """
+        Calls create(**kwargs) with a timeout, retrying transient errors and hedging if configured.
+        Raises CircuitOpenError or DeadlineExceeded without calling when the upstream is written
+        off or the turn is out of time, otherwise the last error once attempts run out.
+        """
+        attempt = 0
+        while True:
+            left = remaining()
+            if left is not None and left <= 0:
+                raise DeadlineExceeded(f"Turn deadline passed before the {purpose} call")
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Upstream circuit is open, not making the {purpose} call")
+            timeout = min(t for t in (self.timeout, left) if t is not None) if (self.timeout, left) != (None, None) else None
+            try:
+                if self.hedge_after and purpose in self.hedge_purposes:
+                    result = self._hedged(purpose, create, kwargs, timeout)
+                else:
+                    result = self._attempt(create, kwargs, timeout)
+            except Exception as e:
+                if not is_transient(e):
+                    self.breaker.record_success()  # The upstream answered, the request itself was bad
+                    raise
+                self.breaker.record_failure()
+                left = remaining()
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                if attempt >= self.retries or (left is not None and left <= delay):
+                    raise
+                attempt += 1
+                logging.warning(f"Retrying {purpose} call in {delay:.2f}s after a transient error: {e}")
+                metrics.UPSTREAM_RETRIES.inc(purpose=purpose)
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _attempt(self, create, kwargs, timeout):
+        if not kwargs.get('stream'):
+            return create(timeout=timeout, **kwargs)
+        stream = create(timeout=timeout, **kwargs)
+        chunks = iter(stream)
+        try:
+            first = next(chunks)
+        except StopIteration:
+            first = None
+        except BaseException:
+            PeekedStream(stream, chunks, None).close()
+            raise
+        return PeekedStream(stream, chunks, first)
+
+    def _hedged(self, purpose, create, kwargs, timeout):
+        deadline = time.monotonic() + timeout
+        # Each attempt runs in its own copy of the context so its metrics land in the current turn
+        submit = lambda: self._hedge_pool.submit(contextvars.copy_context().run, self._attempt, create, kwargs, timeout)
+        primary = submit()
+        pending = {primary}
+        done, _ = wait(pending, timeout=self.hedge_after)
+        if not done:
+            metrics.UPSTREAM_HEDGES.inc(purpose=purpose, result='sent')
+            pending.add(submit())
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            winner = next((future for future in done if future.exception() is None), None)
+            if winner is None:
+                error = next(iter(done)).exception()
+                continue
+            if winner is not primary:
+                metrics.UPSTREAM_HEDGES.inc(purpose=purpose, result='won')
+            for other in (done | pending) - {winner}:
+                other.add_done_callback(_close_result)
+            return winner.result()
+        for other in pending:
+            other.add_done_callback(_close_result)
+        if error is not None:
+            raise error
+        raise AttemptTimeout(f"{purpose} call took longer than {timeout:.1f}s")
@@ -4,6 +4,7 @@ const chatbox = document.querySelector(".box");
 const dealButtons = document.getElementById("deal-buttons");  // Get the deal buttons div
 const dealBtn = document.getElementById("deal-btn");
 const noDealBtn = document.getElementById("no-deal-btn");
+let sessionId = null;  // Issued when a negotiation starts and sent back with every message
 
 sendChatBtn.addEventListener("click", () => {
     let userMessage = chatInput.value.trim();
@@ -23,18 +24,16 @@ chatInput.addEventListener("keypress", (e) => {
     }
 });
 
-function appendMessage(sender, message, typingEffect = false) {
+function appendMessage(sender, message) {
     let messageDiv = document.createElement("div");
     messageDiv.classList.add("item", sender);
 
     let messageContent = document.createElement("div");
     messageContent.classList.add("msg");
 
-    if (typingEffect && sender === "bot") {
-        typeText(message, messageContent);
-    } else {
-        messageContent.innerHTML = `<p>${message}</p>`;
-    }
+    let paragraph = document.createElement("p");
+    paragraph.textContent = message;
+    messageContent.appendChild(paragraph);
 
     messageDiv.innerHTML = `
         <div class="icon">${sender === 'user' ? '😊' : '🤖'}</div>
@@ -42,55 +41,92 @@ function appendMessage(sender, message, typingEffect = false) {
     messageDiv.appendChild(messageContent);
     chatbox.appendChild(messageDiv);
     chatbox.scrollTop = chatbox.scrollHeight;
+    return paragraph;  // Lets streamed replies be filled in as they arrive
 }
 
-function typeText(text, container) {
-    let index = 0;
-    const typingSpeed = 10;
-    let paragraph = document.createElement("p");
-    container.appendChild(paragraph);
-
-    function typeChar() {
-        if (index < text.length) {
-            paragraph.textContent += text.charAt(index);
-            index++;
-            chatbox.scrollTop = chatbox.scrollHeight;  // Scroll to the bottom during typing
-            setTimeout(typeChar, typingSpeed);
-        } else {
-            paragraph.textContent = text;
-            chatbox.scrollTop = chatbox.scrollHeight;  // Ensure scroll at the end
+// Posts a message to a streaming endpoint and renders the reply tokens as they arrive.
+// The final 'done' event carries the session id, the full reply and whether to show the deal buttons.
+function streamFromBackend(body) {
+    const paragraph = appendMessage("bot", "");
+    let buffer = "";
+
+    function handleEvent(rawEvent) {
+        let event = "message";
+        let data = "";
+        rawEvent.split("\n").forEach(line => {
+            if (line.startsWith("event:")) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith("data:")) {
+                data += line.slice(5).trim();
+            }
+        });
+        if (!data) {
+            return;
         }
-    }
+        const payload = JSON.parse(data);
+        if (event === "token") {
+            paragraph.textContent += payload.text;
+        } else if (event === "done") {
+            if (payload.session_id) {
+                sessionId = payload.session_id;  // The backend may start a new session if ours expired
+            }
+            // A closing reply (deal, rejection) replaces the streamed text
+            paragraph.textContent = payload.response || "Sorry, no response!";
 
-    typeChar();
-}
+            // Show or hide deal buttons based on backend response
+            if (payload.show_buttons) {
+                dealButtons.style.display = 'block';  // Show buttons if required
+            } else {
+                dealButtons.style.display = 'none';  // Hide buttons if not needed
+            }
+        }
+        chatbox.scrollTop = chatbox.scrollHeight;  // Scroll to the bottom while the reply grows
+    }
 
-function sendToBackend(message) {
-    fetch('http://127.0.0.1:5000/chatbot', {
+    fetch('http://127.0.0.1:5000/chatbot/stream', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ message: message })
+        body: JSON.stringify(body)
     })
-        .then(response => response.json())
-        .then(data => {
-            const botMessage = data.response || "Sorry, no response!";
-            appendMessage("bot", botMessage, true);
-
-            // Show or hide deal buttons based on backend response
-            if (data.show_buttons) {
-                dealButtons.style.display = 'block';  // Show buttons if required
-            } else {
-                dealButtons.style.display = 'none';  // Hide buttons if not needed
+        .then(response => {
+            if (!response.ok) {
+                // e.g. 429 when the backend is saturated
+                return response.json().then(data => {
+                    paragraph.textContent = data.response || "Sorry, something went wrong!";
+                });
             }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+
+            function read() {
+                return reader.read().then(({ done, value }) => {
+                    if (done) {
+                        return;
+                    }
+                    buffer += decoder.decode(value, { stream: true });
+                    let boundary;
+                    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+                        handleEvent(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                    }
+                    return read();
+                });
+            }
+
+            return read();
         })
         .catch(error => {
             console.error('Error:', error);
-            appendMessage("bot", "Sorry, something went wrong!");
+            paragraph.textContent = "Sorry, something went wrong!";
         });
 }
 
+function sendToBackend(message) {
+    streamFromBackend({ message: message, session_id: sessionId });
+}
+
 // Deal and No Deal button event handlers
 dealBtn.addEventListener("click", () => {
     appendMessage("user", "Deal!");
@@ -105,22 +141,7 @@ noDealBtn.addEventListener("click", () => {
 });
 
 function initializeBackend(message) {
-    fetch('http://127.0.0.1:5000/initialize', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ message: message })
-    })
-        .then(response => response.json())
-        .then(data => {
-            const botMessage = data.response || "Sorry, no response!";
-            appendMessage("bot", botMessage, true);  // Display the bot's response with typing effect
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            appendMessage("bot", "Sorry, something went wrong!");  // Fallback message on error
-        });
+    streamFromBackend({ message: message, initialize: true });  // Starts a new negotiation session
 }
 
 // Function to display the welcome message as a bot message on page load